@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+_facades = {}
+_facades_lock = threading.Lock()
+
+# bcrypt work goes to its own pool so a burst of logins cannot starve other queries
+AUTH_METHODS = {'authenticate', 'validate_login', 'add_user', 'change_username_password'}
+
+
+class _ResultRelay(QObject):
+    # Created on the GUI thread, so results emitted from pool threads are
+    # delivered to the callbacks on the GUI thread
+    finished = pyqtSignal(object, object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.finished.connect(self._deliver)
+
+    def _deliver(self, on_result, on_error, future):
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                print(f"Database request failed: {error}")
+        elif on_result is not None:
+            on_result(future.result())
+
+
+class AsyncDatabase:
+    # Runs Database methods on a thread pool so Qt slots never block on MongoDB.
+    # Every Database method is available with the same arguments plus optional
+    # on_result/on_error callbacks, and returns a concurrent.futures.Future:
+    #
+    #     async_db.get_user_balance(username, on_result=self.show_balance)
+    def __init__(self, db, max_workers=4, auth_workers=2):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Database')
+        self._auth_executor = ThreadPoolExecutor(max_workers=auth_workers, thread_name_prefix='Auth')
+        self._relay = _ResultRelay()
+
+    def call(self, method_name, *args, on_result=None, on_error=None, **kwargs):
+        executor = self._auth_executor if method_name in AUTH_METHODS else self._executor
+        future = executor.submit(getattr(self.db, method_name), *args, **kwargs)
+        if on_result is not None or on_error is not None:
+            future.add_done_callback(lambda done: self._relay.finished.emit(on_result, on_error, done))
+        return future
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(self.db, name, None)):
+            raise AttributeError(name)
+
+        def method(*args, on_result=None, on_error=None, **kwargs):
+            return self.call(name, *args, on_result=on_result, on_error=on_error, **kwargs)
+        return method
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self._auth_executor.shutdown(wait=False)
+
+
+def get_async_database(db):
+    # One facade (and one thread pool) per Database, shared by every screen
+    with _facades_lock:
+        facade = _facades.get(id(db))
+        if facade is None or facade.db is not db:
+            facade = AsyncDatabase(db)
+            _facades[id(db)] = facade
+        return facade
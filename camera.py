@@ -3,10 +3,15 @@ import cv2
 import numpy as np
 from PyQt5 import QtWidgets, QtGui
 from PyQt5.QtCore import QTimer, Qt
-from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import QPushButton, QStackedWidget, QLabel, QVBoxLayout
-from ultralytics import YOLO
 from car_parking_detector import ParkingDetector
+from detection_worker import DetectionWorker
+from db_module import RESERVE_OK, RESERVE_TAKEN
+from async_db import get_async_database
+from occupancy_history import OccupancyHistoryRecorder, MongoHistorySink
+from spot_overlay import SpotOverlayRenderer
+from video_view import VideoView
+from frame_source import default_source
 
 # Configuration variables
 scale_percent = 75
@@ -19,34 +24,55 @@ class MainWindow(QtWidgets.QWidget):
         super().__init__()
 
         self.db = db
+        self.async_db = get_async_database(db)
         self.main_app = main_app
         self.stacked_widget = stacked_widget
         
-        video_path = 'example.mp4'
+        video_path = default_source('example.mp4')
         weights_path = 'yolov8s.pt'
         spots_file = 'parking_spots.txt'
+        # Spot state changes are kept for utilization analytics
+        self.occupancy_history = OccupancyHistoryRecorder(
+            MongoHistorySink(self.db.occupancy_history_collection()), camera_id=video_path)
         self.detector = ParkingDetector(
             video_path, 
             weights_path, 
             spots_file=spots_file, 
             display_scale=scale_percent / 100,
             conf_threshold=0.15,
-            iou_threshold=0.5
+            iou_threshold=0.5,
+            occupancy_mode='exact',
+            enhance_frames=True,
+            history=self.occupancy_history,
+            loop_video=True
         )
-        self.detector.model = YOLO(weights_path)
-        self.detector.model.conf = 0.15
-        self.detector.model.iou = 0.5
-        
         if not self.detector.spots:
             print("No parking spots loaded. Please define spots using spot_drawer.py first.")
-            self.detector.spots = []
+            self.detector.set_spots([])
 
         self.is_paused = False
         self.current_user = None
         self.reserved_spots = []
         self.show_cars = False
         self.frame_counter = 0
-        self.detection_interval = 0.5
+        self.spot_status = {i: False for i in range(len(self.detector.spots))}
+        self.car_detections = np.empty((0, 6), dtype=np.float32)
+        self.free_spaces = None
+        # Spot outlines and labels are laid out once per display scale, not on every frame
+        self.spot_overlay = SpotOverlayRenderer(self.detector.spots, 1.0, font_scale=0.55, thickness=2)
+        # Frame -> view scale, recomputed when the view or the video size changes
+        self.display_key = None
+        self.display_transform = None
+
+        # YOLO runs on a background thread, the GUI only renders the latest result
+        self.detection_worker = DetectionWorker(self.detector, self)
+        self.detection_worker.occupancy_ready.connect(self.on_occupancy_ready)
+        self.detection_worker.spots_changed.connect(self.on_spots_changed)
+        self.detection_worker.start()
+        # A page of the stacked widget never gets a closeEvent, so background
+        # work is also shut down when the application quits
+        self._shut_down = False
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.shutdown)
 
         self.setGeometry(100, 100, int(1920 * 0.8), int(1080 * 0.8))
         self.setWindowTitle('FindMySpot')
@@ -57,13 +83,13 @@ class MainWindow(QtWidgets.QWidget):
         self.setLayout(self.main_layout)
 
         # Video feed
-        self.image_label = QtWidgets.QLabel(self)
-        self.image_label.setMinimumSize(int(1920 * 0.6), int(1080 * 0.6))
-        self.image_label.setMaximumSize(int(1920 * 0.8), int(1080 * 0.8))
-        self.image_label.setScaledContents(True)
-        self.image_label.mousePressEvent = self.toggle_car_visibility
+        self.video_view = VideoView(self)
+        self.video_view.setMinimumSize(int(1920 * 0.6), int(1080 * 0.6))
+        self.video_view.setMaximumSize(int(1920 * 0.8), int(1080 * 0.8))
+        self.video_view.mousePressEvent = self.toggle_car_visibility
+        self.video_view.resized.connect(self.on_video_resized)
 
-        self.overlay_widget = QtWidgets.QWidget(self.image_label)
+        self.overlay_widget = QtWidgets.QWidget(self.video_view)
         self.overlay_widget.setGeometry(10, 10, 200, 60)
         overlay_layout = QtWidgets.QVBoxLayout(self.overlay_widget)
         overlay_layout.setContentsMargins(0, 0, 0, 0)
@@ -72,7 +98,7 @@ class MainWindow(QtWidgets.QWidget):
         self.back_to_dashboard_button.clicked.connect(self.gotoDashboard)
         overlay_layout.addWidget(self.back_to_dashboard_button, 0, Qt.AlignTop | Qt.AlignLeft)
 
-        self.main_layout.addWidget(self.image_label, stretch=3)
+        self.main_layout.addWidget(self.video_view, stretch=3)
         
         # Right panel layout
         self.right_layout = QtWidgets.QVBoxLayout()
@@ -118,9 +144,9 @@ class MainWindow(QtWidgets.QWidget):
 
         self.main_layout.addLayout(self.right_layout, stretch=1)
 
+        # Started in showEvent, so nothing is decoded or detected before login
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_frame)
-        self.timer.start(33)
 
         self.update_info_panel()
 
@@ -128,6 +154,15 @@ class MainWindow(QtWidgets.QWidget):
         with open("style.qss", "r") as f:
             self.setStyleSheet(f.read())
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.timer.isActive():
+            self.timer.start(33)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
+
     def toggle_car_visibility(self, event):
         self.show_cars = not self.show_cars
 
@@ -145,94 +180,72 @@ class MainWindow(QtWidgets.QWidget):
 
     def update_frame(self):
         if not self.is_paused:
-            ret, frame = self.detector.video.read()
+            # Never waits on the decoder, a tick without a new frame keeps the last one
+            ret, frame = self.detector.video.read(timeout=0)
             if ret:
                 self.frame_counter += 1
                 frame = self.process_frame(frame)
-                frame_qt = self.convert_cv_qt(frame)
-                self.image_label.setPixmap(frame_qt)
-            else:
-                self.detector.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.video_view.show_frame(frame)
+
+    def on_occupancy_ready(self, spot_status, car_detections):
+        self.spot_status = spot_status
+        self.car_detections = car_detections
+
+    def on_spots_changed(self, changes):
+        # Only spots that were just vacated are announced, the first pass after
+        # startup marks the occupied ones and should not flood the panel
+        for spot_idx, occupied in changes:
+            if not occupied:
+                self.display_notification(f"Spot {spot_idx} is now free.")
+
+    def on_video_resized(self, width, height):
+        self.display_key = None
+
+    def update_display_transform(self, frame_shape):
+        # Frames are resized once, straight to the view's on-screen size, and
+        # everything drawn on top goes through the same scale
+        height, width = frame_shape[:2]
+        view_width, view_height = max(self.video_view.width(), 1), max(self.video_view.height(), 1)
+        scale_x, scale_y = view_width / width, view_height / height
+        self.display_transform = np.array([scale_x, scale_y, scale_x, scale_y])
+        self.spot_overlay.set_scale(scale_x, scale_y)
+        self.display_key = (width, height, view_width, view_height)
 
     def process_frame(self, frame):
-        if self.frame_counter % self.detection_interval == 0:
-            frame_enhanced = cv2.convertScaleAbs(frame, alpha=1.2, beta=10)
-            results = self.detector.model(frame_enhanced)
-            detections = results[0].boxes.data.cpu().numpy()
-            car_detections = [d for d in detections if int(d[5]) == 2]
-
-            self.detector.spot_status = {i: False for i in range(len(self.detector.spots))}
-            for detection in car_detections:
-                x1, y1, x2, y2 = map(int, detection[:4])
-                box = (x1, y1, x2, y2)
-                spot_indices = self.detector.check_spot_occupation(box)
-                for spot_idx in spot_indices:
-                    if spot_idx >= 0:
-                        self.detector.spot_status[spot_idx] = True
-        else:
-            car_detections = []
-
-        scale_factor = scale_percent / 100 * 2
-        width_resized = int(frame.shape[1] * scale_factor)
-        height_resized = int(frame.shape[0] * scale_factor)
-        frame_resized = cv2.resize(frame, (width_resized, height_resized), interpolation=cv2.INTER_AREA)
-
-        if self.show_cars and self.frame_counter % self.detection_interval == 0:
-            for detection in car_detections:
-                x1, y1, x2, y2 = map(int, detection[:4])
-                x1_display = int(x1 * scale_factor)
-                y1_display = int(y1 * scale_factor)
-                x2_display = int(x2 * scale_factor)
-                y2_display = int(y2 * scale_factor)
-                confidence = float(detection[4])
-                
+        scheduler = self.detector.scheduler
+        if scheduler.should_run(self.frame_counter) and not self.detection_worker.is_busy():
+            scheduler.mark_run(self.frame_counter)
+            # The decoder reuses this frame's buffer on the next read
+            self.detection_worker.submit(frame.copy())
+        car_detections = self.car_detections
+
+        if self.display_key is None or self.display_key[:2] != (frame.shape[1], frame.shape[0]):
+            self.update_display_transform(frame.shape)
+        width_resized, height_resized = self.display_key[2:]
+        # Resized straight into the view's display buffer
+        frame_resized = cv2.resize(frame, (width_resized, height_resized),
+                                   dst=self.video_view.frame_buffer(width_resized, height_resized),
+                                   interpolation=cv2.INTER_AREA)
+
+        if self.show_cars and len(car_detections):
+            boxes = (car_detections[:, :4] * self.display_transform).astype(int).tolist()
+            for (x1_display, y1_display, x2_display, y2_display), confidence in zip(boxes, car_detections[:, 4].tolist()):
                 color = (0, 255, 0) if confidence > 0.5 else (255, 165, 0)
                 cv2.rectangle(frame_resized, (x1_display, y1_display), (x2_display, y2_display), color, 2)
-                cv2.putText(frame_resized, f'Car {confidence:.2f}', (x1_display, y1_display - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+                cv2.putText(frame_resized, f'Car {confidence:.2f}', (x1_display, y1_display - 5),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
 
-        free_spaces = len(self.detector.spots)
         self.reserved_spots = self.db.get_all_reserved_spots()
-        for i, spot in enumerate(self.detector.spots):
-            scaled_spot = [int(coord * scale_factor) for coord in spot]
-            pts = np.array([[scaled_spot[j], scaled_spot[j+1]] for j in range(0, 8, 2)], np.int32)
-            pts = pts.reshape((-1, 1, 2))
-
-            if i in self.reserved_spots:
-                color = (0, 255, 255)  # Yellow
-                free_spaces -= 1
-            elif not self.detector.spot_status[i]:
-                color = (57, 255, 20)  # Green
-            else:
-                color = (0, 0, 255)   # Red
-                free_spaces -= 1
-
-            cv2.polylines(frame_resized, [pts], True, color, 2)
-            spot_center_x = int(sum(scaled_spot[::2]) / 4)
-            spot_center_y = int(sum(scaled_spot[1::2]) / 4)
-            text = f"Spot {i}"
-            text_size, _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1.0, 3)
-            text_x = spot_center_x - text_size[0] // 2
-            text_y = spot_center_y + text_size[1] // 2
-            cv2.rectangle(frame_resized, 
-                          (text_x - 5, text_y - text_size[1] - 5), 
-                          (text_x + text_size[0] + 5, text_y + 5), 
-                          (50, 50, 50), -1)
-            cv2.putText(frame_resized, text, (text_x, text_y),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, color, 3)
-
-        self.info_panel.setText(f"Free spaces: {free_spaces}")
+        free_spaces = self.spot_overlay.render(frame_resized, self.spot_status, self.reserved_spots)
+        if free_spaces != self.free_spaces:
+            self.free_spaces = free_spaces
+            self.info_panel.setText(f"Free spaces: {free_spaces}")
         return frame_resized
 
-    def convert_cv_qt(self, frame):
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        convert_to_qt_format = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        return QPixmap.fromImage(convert_to_qt_format)
-
     def update_info_panel(self):
         self.info_panel.setText("Parking Information\nShows available spaces and status.")
+        # The free space count was overwritten, draw it again on the next frame
+        self.free_spaces = None
 
     def display_notification(self, message):
         current_text = self.notification_panel.toPlainText()
@@ -242,53 +255,80 @@ class MainWindow(QtWidgets.QWidget):
         try:
             space_number = int(self.space_input.text())
             if 0 <= space_number < len(self.detector.spots):
-                username = self.current_user
-                dashboard_index = self.main_app.widget_indices.get('dashboard_screen')
-                dashboard_screen = self.stacked_widget.widget(dashboard_index)
-
-                if self.db.get_user_balance(username) >= 5:
-                    success = self.db.reserve_parking_spot(username, space_number)
-                    if success:
-                        reserved_spaces.add(tuple(self.detector.spots[space_number]))
-                        self.db.update_account_balance(username, -5)
-                        if hasattr(dashboard_screen, 'update_dashboard'):
-                            dashboard_screen.update_dashboard()
-                        self.space_input.clear()
-                        self.display_notification("Space reserved successfully. You have 3 minutes.")
-                        dashboard_screen.start_reservation_timer(space_number)
-                    else:
-                        self.display_notification("Space already reserved!")
-                else:
-                    self.display_notification("Insufficient balance to reserve a space.")
+                self.reserve_button.setEnabled(False)
+                self.async_db.reserve_and_charge(
+                    self.current_user, space_number,
+                    on_result=lambda result: self.finish_reserve(space_number, result),
+                    on_error=self.show_request_error
+                )
             else:
                 self.display_notification("Invalid space number!")
         except ValueError:
             self.display_notification("Invalid input for space number.")
 
+    def finish_reserve(self, space_number, result):
+        self.reserve_button.setEnabled(True)
+        dashboard_index = self.main_app.widget_indices.get('dashboard_screen')
+        dashboard_screen = self.stacked_widget.widget(dashboard_index)
+
+        if result == RESERVE_OK:
+            reserved_spaces.add(tuple(self.detector.spots[space_number]))
+            if hasattr(dashboard_screen, 'update_dashboard'):
+                dashboard_screen.update_dashboard()
+            self.space_input.clear()
+            self.display_notification("Space reserved successfully. You have 3 minutes.")
+            dashboard_screen.start_reservation_timer(space_number)
+        elif result == RESERVE_TAKEN:
+            self.display_notification("Space already reserved!")
+        else:
+            self.display_notification("Insufficient balance to reserve a space.")
+
     def unreserve_space(self):
         try:
             space_number = int(self.space_input.text())
             if 0 <= space_number < len(self.detector.spots):
-                success = self.db.unreserve_parking_spot(self.current_user, space_number)
-                if success:
-                    spot_tuple = tuple(self.detector.spots[space_number])
-                    if spot_tuple in reserved_spaces:
-                        reserved_spaces.remove(spot_tuple)
-                    self.update_info_panel()
-                    self.space_input.clear()
-                    self.db.update_account_balance(self.current_user, 5)
-                    dashboard_screen = self.stacked_widget.widget(1)
-                    dashboard_screen.update_dashboard()
-                    self.display_notification("Space unreserved successfully.")
-                else:
-                    self.display_notification("You have not reserved this space.")
+                self.unreserve_button.setEnabled(False)
+                self.async_db.unreserve_and_refund(
+                    self.current_user, space_number,
+                    on_result=lambda success: self.finish_unreserve(space_number, success),
+                    on_error=self.show_request_error
+                )
             else:
                 self.display_notification("Invalid space number!")
         except ValueError:
             self.display_notification("Invalid input for space number.")
 
-    def closeEvent(self, event):
+    def finish_unreserve(self, space_number, success):
+        self.unreserve_button.setEnabled(True)
+        if success:
+            spot_tuple = tuple(self.detector.spots[space_number])
+            if spot_tuple in reserved_spaces:
+                reserved_spaces.remove(spot_tuple)
+            self.update_info_panel()
+            self.space_input.clear()
+            dashboard_screen = self.stacked_widget.widget(1)
+            dashboard_screen.update_dashboard()
+            self.display_notification("Space unreserved successfully.")
+        else:
+            self.display_notification("You have not reserved this space.")
+
+    def show_request_error(self, error):
+        self.reserve_button.setEnabled(True)
+        self.unreserve_button.setEnabled(True)
+        self.display_notification(f"Could not reach the server: {error}")
+
+    def shutdown(self):
+        if self._shut_down:
+            return
+        self._shut_down = True
+        self.timer.stop()
+        self.detection_worker.stop()
         self.detector.video.release()
+        # Writes out the state changes still buffered in memory
+        self.occupancy_history.close()
+
+    def closeEvent(self, event):
+        self.shutdown()
 
 if __name__ == '__main__':
     from db_module import Database
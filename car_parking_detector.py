@@ -1,20 +1,107 @@
+import sys
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from model_registry import get_model
+from frame_source import open_frame_source, default_source
+from occupancy import SpotOccupancyEngine, SpotStateTracker, SpotChangeDetector
+
+class DetectionScheduler:
+    # 'frames' runs every N frames, 'interval' every T milliseconds and 'adaptive'
+    # spaces runs by the measured inference latency times adaptive_factor
+    MODES = ('frames', 'interval', 'adaptive')
+
+    def __init__(self, mode='frames', every_n_frames=5, interval_ms=500, adaptive_factor=2.0,
+                 min_interval_ms=100, max_interval_ms=2000):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown detection mode: {mode}")
+        if every_n_frames < 1:
+            raise ValueError("every_n_frames must be at least 1")
+        self.mode = mode
+        self.every_n_frames = int(every_n_frames)
+        self.interval_ms = interval_ms
+        self.adaptive_factor = adaptive_factor
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.latency_ms = None
+        self.last_run_frame = None
+        self.last_run_time = None
+
+    def current_interval_ms(self):
+        if self.mode == 'interval':
+            return self.interval_ms
+        if self.latency_ms is None:
+            return self.min_interval_ms
+        interval = self.latency_ms * self.adaptive_factor
+        return min(max(interval, self.min_interval_ms), self.max_interval_ms)
+
+    def should_run(self, frame_index, now=None):
+        if self.mode == 'frames':
+            return self.last_run_frame is None or frame_index - self.last_run_frame >= self.every_n_frames
+        now = time.monotonic() if now is None else now
+        if self.last_run_time is None:
+            return True
+        return (now - self.last_run_time) * 1000 >= self.current_interval_ms()
+
+    def mark_run(self, frame_index, now=None):
+        self.last_run_frame = frame_index
+        self.last_run_time = time.monotonic() if now is None else now
+
+    def record_latency(self, seconds):
+        # Smoothed so a single slow frame does not stall detection for long
+        latency_ms = seconds * 1000
+        if self.latency_ms is None:
+            self.latency_ms = latency_ms
+        else:
+            self.latency_ms = 0.8 * self.latency_ms + 0.2 * latency_ms
 
 class ParkingDetector:
-    def __init__(self, video_path, weights_path, spots_file='', display_scale=0.5, conf_threshold=0.2, iou_threshold=0.2):
-        self.model = YOLO(weights_path)
-        self.video = cv2.VideoCapture(video_path)
-        if not self.video.isOpened():
-            raise ValueError(f"Could not open video file: {video_path}")
+    def __init__(self, video_path, weights_path, spots_file='', display_scale=0.5, conf_threshold=0.2, iou_threshold=0.2,
+                 scheduler=None, occupancy_mode='bbox', state_tracker=None, roi_margin=48, enhance_frames=False,
+                 change_gate=True, inference_service=None, history=None, inference_size=640, loop_video=False,
+                 latest_frame_only=None):
+        # The model is loaded on first inference and shared through model_registry
+        self.weights_path = weights_path
+        self._model = None
+        # video_path is anything open_frame_source accepts (file, stream URL,
+        # image directory, synthetic://) and is decoded ahead on its own thread
+        self.video = open_frame_source(video_path, loop=loop_video, latest_only=latest_frame_only)
         
         self.spots = self.load_spots(spots_file)
+        self.occupancy_engine = SpotOccupancyEngine(self.spots, mode=occupancy_mode)
+        self.state_tracker = state_tracker if state_tracker is not None else SpotStateTracker(len(self.spots))
+        self.state_tracker.reset(len(self.spots))
         self.spot_status = {i: False for i in range(len(self.spots))}
+        self.spot_changes = []
         self.display_scale = display_scale
         self.show_cars = True
         self.conf_threshold = conf_threshold
         self.iou_threshold = iou_threshold
+        self.scheduler = scheduler if scheduler is not None else DetectionScheduler()
+        self.car_detections = np.empty((0, 6), dtype=np.float32)
+        # Inference only sees the region around the spots; None runs on the full frame
+        self.roi_margin = roi_margin
+        self.enhance_frames = enhance_frames
+        # The region is shrunk to the model's input size (YOLOv8 default 640)
+        # before inference; None passes it at full resolution
+        self.inference_size = inference_size
+        self._inference_key = None
+        # Skips inference while nothing changed inside the spots
+        self.change_detector = SpotChangeDetector(self.spots) if change_gate else None
+        # Optional InferenceService shared with other cameras, batches model calls
+        self.inference_service = inference_service
+        # Optional OccupancyHistoryRecorder that receives every state change
+        self.history = history
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_model(self.weights_path)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
 
     def load_spots(self, filename):
         spots = []
@@ -28,72 +115,150 @@ class ParkingDetector:
             print(f"Warning: {filename} not found. Please define spots first.")
         return spots
 
-    def intersect_area(self, box, spot):
-        spot_x = [spot[i] for i in range(0, 8, 2)]
-        spot_y = [spot[i] for i in range(1, 8, 2)]
-        spot_x1, spot_y1 = min(spot_x), min(spot_y)
-        spot_x2, spot_y2 = max(spot_x), max(spot_y)
-        
-        box_x1, box_y1, box_x2, box_y2 = box
-        
-        inter_x1 = max(box_x1, spot_x1)
-        inter_y1 = max(box_y1, spot_y1)
-        inter_x2 = min(box_x2, spot_x2)
-        inter_y2 = min(box_y2, spot_y2)
-        
-        if inter_x1 < inter_x2 and inter_y1 < inter_y2:
-            inter_area = (inter_x2 - inter_x1) * (inter_y2 - inter_y1)
-            box_area = (box_x2 - box_x1) * (box_y2 - box_y1)
-            spot_area = (spot_x2 - spot_x1) * (spot_y2 - spot_y1)
-            return inter_area / min(box_area, spot_area)
-        return 0.0
+    def set_spots(self, spots):
+        self.spots = spots
+        self.occupancy_engine.set_spots(spots)
+        self.state_tracker.reset(len(spots))
+        self.spot_status = {i: False for i in range(len(spots))}
+        self._spots_edited()
+
+    def add_spot(self, spot):
+        self.spots.append(spot)
+        self.occupancy_engine.add_spot(spot)
+        self.state_tracker.add_spot()
+        self.spot_status[len(self.spots) - 1] = False
+        self._spots_edited()
+
+    def update_spot(self, spot_idx, spot):
+        self.spots[spot_idx] = spot
+        self.occupancy_engine.update_spot(spot_idx, spot)
+        self.state_tracker.reset_spot(spot_idx)
+        self.spot_status[spot_idx] = False
+        self._spots_edited()
+
+    def remove_spot(self, spot_idx):
+        del self.spots[spot_idx]
+        self.occupancy_engine.remove_spot(spot_idx)
+        self.state_tracker.remove_spot(spot_idx)
+        self.spot_status = dict(enumerate(self.state_tracker.state.tolist()))
+        self._spots_edited()
+
+    def _spots_edited(self):
+        self._inference_key = None
+        if self.change_detector is not None:
+            self.change_detector.set_spots(self.spots)
 
     def check_spot_occupation(self, box):
-        x1, y1, x2, y2 = box
-        occupied_spots = []
-        
-        for i, spot in enumerate(self.spots):
-            overlap = self.intersect_area(box, spot)
-            if overlap > 0.5:
-                occupied_spots.append(i)
-        
+        overlap = self.occupancy_engine.overlap([box])[0]
+        occupied_spots = np.flatnonzero(overlap > self.occupancy_engine.threshold).tolist()
         return occupied_spots if occupied_spots else [-1]
 
+    def spot_region(self, frame_shape):
+        # Union of all spot bounds plus roi_margin, clipped to the frame
+        height, width = frame_shape[:2]
+        if self.roi_margin is None or not self.spots:
+            return 0, 0, width, height
+        bounds = self.occupancy_engine.bounds
+        x1 = max(int(bounds[:, 0].min()) - self.roi_margin, 0)
+        y1 = max(int(bounds[:, 1].min()) - self.roi_margin, 0)
+        x2 = min(int(np.ceil(bounds[:, 2].max())) + self.roi_margin, width)
+        y2 = min(int(np.ceil(bounds[:, 3].max())) + self.roi_margin, height)
+        if x1 >= x2 or y1 >= y2:
+            return 0, 0, width, height
+        return x1, y1, x2, y2
+
+    def inference_transform(self, frame_shape):
+        # Region, model input size and the box scale/offset back to frame
+        # coordinates; only recomputed when the frame size or the spots change
+        if self._inference_key != frame_shape[:2]:
+            x1, y1, x2, y2 = self.spot_region(frame_shape)
+            width, height = x2 - x1, y2 - y1
+            scale = 1.0
+            if self.inference_size is not None and max(width, height) > self.inference_size:
+                scale = self.inference_size / max(width, height)
+            size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+            box_scale = np.array([width / size[0], height / size[1]] * 2, dtype=np.float32)
+            box_offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+            self._inference = ((x1, y1, x2, y2), size, box_scale, box_offset)
+            self._inference_key = frame_shape[:2]
+        return self._inference
+
+    def find_cars(self, frame):
+        start = time.monotonic()
+        (x1, y1, x2, y2), size, box_scale, box_offset = self.inference_transform(frame.shape)
+        crop = frame[y1:y2, x1:x2]
+        if size != (x2 - x1, y2 - y1):
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        if self.enhance_frames:
+            crop = cv2.convertScaleAbs(crop, alpha=1.2, beta=10)
+        if self.inference_service is not None:
+            detections = self.inference_service.infer(crop, self.conf_threshold, self.iou_threshold)
+        else:
+            results = self.model(crop, conf=self.conf_threshold, iou=self.iou_threshold)
+            detections = results[0].boxes.data.cpu().numpy()
+        self.scheduler.record_latency(time.monotonic() - start)
+
+        # Map boxes from the model input back to frame coordinates
+        car_detections = detections[detections[:, 5].astype(int) == 2].copy()
+        car_detections[:, :4] = car_detections[:, :4] * box_scale + box_offset
+        self.car_detections = car_detections
+        return self.car_detections
+
+    def update_occupancy(self, car_detections):
+        # Raw per-pass occupancy goes through the state tracker, so a single
+        # missed detection does not flip a spot
+        occupied = self.occupancy_engine.occupancy(car_detections)
+        self.spot_changes = self.state_tracker.update(occupied)
+        self.spot_status = dict(enumerate(self.state_tracker.state.tolist()))
+        if self.history is not None and self.spot_changes:
+            self.history.record_changes(self.spot_changes)
+        return self.spot_status
+
+    def run_detection(self, frame):
+        # Returns False when the change gate decided inference was not needed
+        # and the last occupancy still holds. The gate only applies once the
+        # state tracker has settled, otherwise a change seen by one pass would
+        # not get the follow-up passes it needs to flip a spot.
+        if (self.change_detector is not None and self.state_tracker.is_settled()
+                and not self.change_detector.should_run(frame)):
+            return False
+        self.update_occupancy(self.find_cars(frame))
+        if self.change_detector is not None:
+            self.change_detector.mark_inference(frame)
+        return True
+
     def detect(self):
         cv2.namedWindow('Parking Detection', cv2.WINDOW_NORMAL)
         print("Press 't' to toggle car detection visibility, 'q' to quit")
+        frame_index = 0
         
-        while self.video.isOpened():
+        while self.video.is_opened():
             ret, frame = self.video.read()
             if not ret:
                 print("End of video or error reading frame")
                 break
+            frame_index += 1
                 
             height, width = frame.shape[:2]
             new_width = int(width * self.display_scale)
             new_height = int(height * self.display_scale)
             display_frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
             
-            results = self.model(frame, conf=self.conf_threshold, iou=self.iou_threshold)
-            car_detections = [box for box in results[0].boxes if int(box.cls) == 2]
-            
-            self.spot_status = {i: False for i in range(len(self.spots))}
+            # Between scheduled runs the last detections and spot_status are reused
+            if self.scheduler.should_run(frame_index):
+                self.scheduler.mark_run(frame_index)
+                self.run_detection(frame)
+            car_detections = self.car_detections
             
             for detection in car_detections:
-                x1, y1, x2, y2 = map(int, detection.xyxy[0])
-                box = (x1, y1, x2, y2)
-                spot_indices = self.check_spot_occupation(box)
-                
-                for spot_idx in spot_indices:
-                    if spot_idx >= 0:
-                        self.spot_status[spot_idx] = True
+                x1, y1, x2, y2 = map(int, detection[:4])
                 
                 if self.show_cars:
                     x1_display = int(x1 * self.display_scale)
                     y1_display = int(y1 * self.display_scale)
                     x2_display = int(x2 * self.display_scale)
                     y2_display = int(y2 * self.display_scale)
-                    confidence = float(detection.conf)
+                    confidence = float(detection[4])
                     
                     cv2.rectangle(display_frame, (x1_display, y1_display), (x2_display, y2_display), (0, 255, 0), 1)
                     # Smaller car label (font size reduced from 0.5 to 0.4)
@@ -122,7 +287,7 @@ class ParkingDetector:
         cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    video_path = 'example1.mp4'
+    video_path = sys.argv[1] if len(sys.argv) > 1 else default_source('example1.mp4')
     weights_path = 'yolov8s.pt'
     try:
         detector = ParkingDetector(video_path, weights_path, display_scale=0.5, conf_threshold=0.4, iou_threshold=0.6)
@@ -1,17 +1,23 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem, QHeaderView, QHBoxLayout
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import QUrl, QTimer, Qt, QRect
+from PyQt5.QtCore import QUrl, QTimer, Qt, QRect, pyqtSignal
 from PyQt5.QtGui import QDesktopServices, QPalette, QColor
 from PyQt5.QtWidgets import QMessageBox
 from camera import MainWindow
+from async_db import get_async_database
 
 class DashboardScreen(QWidget):
+    # Relays expiry events from the expiry thread onto the GUI thread
+    reservation_expired = pyqtSignal(int, object)
+
     def __init__(self, stacked_widget, widget_indices, db, current_user):
         super().__init__()
         self.stacked_widget = stacked_widget
         self.widget_indices = widget_indices
         self.db = db
+        self.async_db = get_async_database(db)
         self.current_user = current_user
+        self.session_token = None
         layout = QVBoxLayout(self)
 
         header_layout = QHBoxLayout()
@@ -53,6 +59,9 @@ class DashboardScreen(QWidget):
         self.active_spot = None
         self.popup_shown = False
 
+        self.reservation_expired.connect(self.on_reservation_expired)
+        self.db.expiry.subscribe(self.reservation_expired.emit)
+
         self.update_reservations()  # Now safe to call after active_spot is defined
 
         self.setLayout(layout)
@@ -87,11 +96,18 @@ class DashboardScreen(QWidget):
                             f"Your reservation for parking spot {self.active_spot} is expiring in 1 minute."
                         )
         else:
-            self.db.unreserve_parking_spot(self.current_user, self.active_spot)
+            # The expiry service releases the spot, only the view is reset here
             self.active_spot = None
             self.popup_shown = False
             self.update_reservations()
 
+    def on_reservation_expired(self, spot_id, username):
+        if username != self.current_user:
+            return
+        if spot_id == self.active_spot:
+            self.active_spot = None
+            self.popup_shown = False
+        self.update_reservations()
 
 
     def update_dashboard(self):
@@ -103,8 +119,17 @@ class DashboardScreen(QWidget):
     def set_current_user(self, username):
         self.current_user = username
 
+    def set_session(self, token, session):
+        # The session already carries the user document, no need to fetch it again
+        self.session_token = token
+        self.current_user = session['username']
+        self.update_reservations()
+        self.show_balance(session['user'].get('balance', 0))
+
     def update_balance(self):
-        balance = self.db.get_user(self.current_user)['balance']
+        self.async_db.get_user_balance(self.current_user, on_result=self.show_balance)
+
+    def show_balance(self, balance):
         self.balance_label.setText(f'Balance: ${balance}')
 
     def update_reservations(self):
@@ -134,6 +159,9 @@ class DashboardScreen(QWidget):
         self.stacked_widget.setCurrentIndex(2)
 
     def logout(self):
+        if self.session_token is not None:
+            self.db.end_session(self.session_token)
+            self.session_token = None
         self.stacked_widget.setCurrentIndex(0)
 
     def gotoUI(self):
@@ -1,15 +1,333 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, ASCENDING
+from pymongo.errors import PyMongoError, OperationFailure, DuplicateKeyError, CollectionInvalid
 import bcrypt
 import datetime
-from twilio.rest import Client
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from notification_dispatcher import get_dispatcher
+from reservation_expiry import ReservationExpiryService
+
+RESERVATION_COST = 5
+SESSION_TTL = datetime.timedelta(hours=8)
+USER_CACHE_TTL = 30.0  # seconds
+REFUND_SWEEP_INTERVAL = 60.0  # seconds between retries of refunds that failed
+REFUND_RETRIES = 3
+
+# reserve_and_charge results
+RESERVE_OK = 'reserved'
+RESERVE_TAKEN = 'taken'
+RESERVE_INSUFFICIENT_FUNDS = 'insufficient_funds'
+
+# (collection, keys, options) for every index the hot queries rely on
+REQUIRED_INDEXES = [
+    ('users', [("username", ASCENDING)], {"unique": True}),
+    ('parking_spots', [("spotId", ASCENDING)], {"unique": True}),
+    ('parking_spots', [("isReserved", ASCENDING), ("spotId", ASCENDING)],
+     {"partialFilterExpression": {"isReserved": True}}),
+    ('parking_spots', [("reservedBy", ASCENDING), ("spotId", ASCENDING)],
+     {"partialFilterExpression": {"isReserved": True}}),
+    ('parking_spots', [("pendingRefund.refundId", ASCENDING)], {"sparse": True}),
+]
+
+
+# Connection settings. Overridden by the JSON file named in FINDMYSPOT_DB_CONFIG
+# (db_config.json by default) and then by the environment variables below
+DEFAULT_DB_CONFIG = {
+    "uri": "mongodb://localhost:27017",
+    "database": "findmyspot_db",
+    "maxPoolSize": 20,
+    "minPoolSize": 0,
+    "serverSelectionTimeoutMS": 5000,
+    "connectTimeoutMS": 5000,
+    "socketTimeoutMS": 10000,
+    "readPreference": "primary",
+    "w": 1,
+}
+
+DB_CONFIG_ENV = {
+    "uri": "FINDMYSPOT_MONGO_URI",
+    "database": "FINDMYSPOT_MONGO_DATABASE",
+    "maxPoolSize": "FINDMYSPOT_MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "FINDMYSPOT_MONGO_MIN_POOL_SIZE",
+    "serverSelectionTimeoutMS": "FINDMYSPOT_MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "FINDMYSPOT_MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "FINDMYSPOT_MONGO_SOCKET_TIMEOUT_MS",
+    "readPreference": "FINDMYSPOT_MONGO_READ_PREFERENCE",
+    "w": "FINDMYSPOT_MONGO_WRITE_CONCERN",
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _env_value(value):
+    # Numbers come through as ints, anything else (e.g. w=majority) stays a string
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+def load_database_config(path=None, overrides=None):
+    config = dict(DEFAULT_DB_CONFIG)
+    path = path or os.environ.get('FINDMYSPOT_DB_CONFIG', 'db_config.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            config.update(json.load(f))
+    for key, env_name in DB_CONFIG_ENV.items():
+        if env_name in os.environ:
+            config[key] = _env_value(os.environ[env_name])
+    if overrides:
+        config.update(overrides)
+    return config
+
+
+def get_client(config):
+    # One MongoClient (and so one connection pool) per process and settings,
+    # shared by every Database instance
+    options = {key: value for key, value in config.items() if key not in ("uri", "database")}
+    key = (config["uri"], tuple(sorted((name, str(value)) for name, value in options.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = MongoClient(config["uri"], **options)
+            _clients[key] = client
+        return client
+
+
+def find_duplicates(collection, keys, limit=None):
+    # Groups of documents sharing the values of keys, [{"_id": {...}, "ids": [...], "count": n}]
+    pipeline = [
+        {"$group": {"_id": {field: f"${field}" for field, _ in keys}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return list(collection.aggregate(pipeline))
+
+
+def deduplicate(db):
+    # One-off migration for data written before the unique indexes existed.
+    # Duplicate users keep their balance and are renamed, the oldest account
+    # keeps the name. Duplicate spot documents are dropped in favour of the one
+    # holding a reservation (or the oldest); ones still owing a refund are left
+    # alone and reported.
+    for group in find_duplicates(db['users'], [("username", ASCENDING)]):
+        username = group["_id"]["username"]
+        for user_id in sorted(group["ids"])[1:]:
+            new_name = f"{username}-{str(user_id)[-6:]}"
+            db['users'].update_one({"_id": user_id}, {"$set": {"username": new_name}})
+            print(f"Renamed duplicate user {username!r} ({user_id}) to {new_name!r}")
+    for group in find_duplicates(db['parking_spots'], [("spotId", ASCENDING)]):
+        spot_id = group["_id"]["spotId"]
+        spots = list(db['parking_spots'].find({"_id": {"$in": group["ids"]}}))
+        spots.sort(key=lambda spot: (not spot.get("isReserved"), spot["_id"]))
+        for spot in spots[1:]:
+            if spot.get("pendingRefund"):
+                print(f"Duplicate spot {spot_id} ({spot['_id']}) still owes a refund, resolve it by hand")
+                continue
+            db['parking_spots'].delete_one({"_id": spot["_id"]})
+            print(f"Removed duplicate document {spot['_id']} for spot {spot_id}")
 
 
 class Database:
-    def __init__(self):
-        self.client = MongoClient("mongodb://localhost:27017")  # Update as needed
-        self.db = self.client['findmyspot_db']
+    def __init__(self, config=None, reservation_poll_interval=5.0, user_cache_ttl=USER_CACHE_TTL):
+        # config is a dict of overrides on top of load_database_config()
+        self.config = load_database_config(overrides=config)
+        self.client = get_client(self.config)
+        self.db = self.client[self.config["database"]]
         self.users = self.db['users']
         self.parking_spots = self.db['parking_spots']  # New collection for parking spots
+        self.notifier = get_dispatcher()
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        # Write-through user profile cache, username -> (user document, cached at).
+        # Our own writes refresh or invalidate it, the TTL bounds staleness from
+        # writes made by other kiosks
+        self.user_cache_ttl = user_cache_ttl
+        self._user_cache = {}
+        self._user_cache_lock = threading.Lock()
+        self.ensure_indexes()
+
+        # Active reservations kept in memory, spotId -> {"reservedBy", "expirationTime"}.
+        # Loaded once, updated by our own writes and kept fresh by a background
+        # change stream (or a low-frequency poll when the server has no change streams)
+        self.reservation_poll_interval = reservation_poll_interval
+        self._reservations = {}
+        self._reservations_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Releases every reservation at its expirationTime, screens subscribe to it
+        self.expiry = ReservationExpiryService(self)
+        # The change stream is opened before the initial load, so a change made
+        # in between is replayed by the stream instead of being missed
+        self._reservation_stream = self._open_reservation_stream()
+        self.load_reservations()
+        self._reservation_thread = threading.Thread(target=self._sync_reservations, daemon=True)
+        self._reservation_thread.start()
+        self.expiry.start()
+
+    def ensure_indexes(self):
+        # create_index is a no-op for indexes that already exist. The unique
+        # indexes are what stops duplicate users and double-booked spots (the
+        # reservation upsert relies on the spotId one), so without them the
+        # Database refuses to start instead of silently double-booking.
+        try:
+            self.client.admin.command('ping')
+        except PyMongoError as e:
+            raise RuntimeError(f"Could not reach MongoDB at {self.config['uri']}: {e}") from None
+        for collection_name, keys, options in REQUIRED_INDEXES:
+            try:
+                self.db[collection_name].create_index(keys, **options)
+            except PyMongoError as e:
+                print(f"Could not create index {keys} on {collection_name}: {e}")
+        for collection_name, keys, options in REQUIRED_INDEXES:
+            if options.get("unique") and not self._has_unique_index(collection_name, keys):
+                duplicates = find_duplicates(self.db[collection_name], keys, limit=10)
+                if duplicates:
+                    values = ", ".join(str(group["_id"]) for group in duplicates)
+                    raise RuntimeError(f"Unique index {keys} on {collection_name} cannot be created, duplicate "
+                                       f"documents exist for {values}. Run `python db_module.py --dedupe` "
+                                       f"to resolve them, then restart.")
+                raise RuntimeError(f"Unique index {keys} on {collection_name} is missing, "
+                                   f"reservations are not safe without it")
+
+    def _has_unique_index(self, collection_name, keys):
+        for index in self.db[collection_name].index_information().values():
+            if index.get("unique") and [(field, direction) for field, direction in index["key"]] == keys:
+                return True
+        return False
+
+    def hot_queries(self):
+        return [
+            ('user by username', self.users, {"username": ""}),
+            ('spot by spotId', self.parking_spots, {"spotId": 0}),
+            ('active reservations', self.parking_spots, {"isReserved": True}),
+            ('active reservations by user', self.parking_spots, {"reservedBy": "", "isReserved": True}),
+        ]
+
+    def check_indexes(self):
+        # Returns the names of hot queries whose winning plan scans the collection
+        unindexed = []
+        for name, collection, query in self.hot_queries():
+            plan = collection.find(query).explain()['queryPlanner']['winningPlan']
+            if 'COLLSCAN' in self._plan_stages(plan):
+                unindexed.append(name)
+        return unindexed
+
+    def _plan_stages(self, plan):
+        stages = set()
+        if isinstance(plan, dict):
+            if 'stage' in plan:
+                stages.add(plan['stage'])
+            for value in plan.values():
+                stages |= self._plan_stages(value)
+        elif isinstance(plan, list):
+            for value in plan:
+                stages |= self._plan_stages(value)
+        return stages
+
+    def occupancy_history_collection(self, name='occupancy_events'):
+        # Time-series collection on MongoDB 5.0+, a plain collection otherwise
+        if name not in self.db.list_collection_names():
+            try:
+                self.db.create_collection(
+                    name, timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"})
+            except CollectionInvalid:
+                pass  # Created by another kiosk in the meantime
+            except OperationFailure as e:
+                print(f"Time-series collections unavailable, using a plain collection: {e}")
+                self.db[name].create_index([("meta.cameraId", ASCENDING), ("meta.spotId", ASCENDING),
+                                            ("timestamp", ASCENDING)])
+        return self.db[name]
+
+    def close(self):
+        self._stop_event.set()
+        self.expiry.stop()
+
+    def load_reservations(self):
+        reserved = self.parking_spots.find(
+            {"isReserved": True}, {"spotId": 1, "reservedBy": 1, "expirationTime": 1, "_id": 0})
+        reservations = {
+            int(spot['spotId']): {"reservedBy": spot.get('reservedBy'), "expirationTime": spot.get('expirationTime')}
+            for spot in reserved
+        }
+        with self._reservations_lock:
+            released = set(self._reservations) - set(reservations)
+            self._reservations = reservations
+        for spot_id in released:
+            self.expiry.cancel(spot_id)
+        for spot_id, reservation in reservations.items():
+            self.expiry.schedule(spot_id, reservation['expirationTime'])
+
+    def _cache_reservation(self, spot_id, username, expiration_time):
+        with self._reservations_lock:
+            self._reservations[int(spot_id)] = {"reservedBy": username, "expirationTime": expiration_time}
+        self.expiry.schedule(int(spot_id), expiration_time)
+
+    def _uncache_reservation(self, spot_id):
+        with self._reservations_lock:
+            self._reservations.pop(int(spot_id), None)
+        self.expiry.cancel(int(spot_id))
+
+    def _apply_spot_document(self, spot):
+        if spot.get('isReserved'):
+            self._cache_reservation(spot['spotId'], spot.get('reservedBy'), spot.get('expirationTime'))
+        else:
+            self._uncache_reservation(spot['spotId'])
+
+    def _open_reservation_stream(self):
+        # None when the server cannot provide one, reservations are polled then
+        try:
+            return self.parking_spots.watch(full_document='updateLookup')
+        except OperationFailure:
+            # Standalone servers do not support change streams
+            return None
+        except PyMongoError as e:
+            print(f"Could not open the reservation change stream: {e}")
+            return None
+
+    def _sync_reservations(self):
+        # Refunds left over from a previous run
+        self._sweep_pending_refunds()
+        stream, self._reservation_stream = self._reservation_stream, None
+        if stream is None:
+            self._poll_reservations()
+            return
+        try:
+            self._watch_reservations(stream)
+        except PyMongoError as e:
+            print(f"Reservation change stream stopped: {e}")
+            self._poll_reservations()
+
+    def _watch_reservations(self, stream):
+        next_sweep = time.monotonic() + REFUND_SWEEP_INTERVAL
+        with stream:
+            while not self._stop_event.is_set():
+                if time.monotonic() >= next_sweep:
+                    self._sweep_pending_refunds()
+                    next_sweep = time.monotonic() + REFUND_SWEEP_INTERVAL
+                change = stream.try_next()
+                if change is None:
+                    self._stop_event.wait(0.5)
+                    continue
+                spot = change.get('fullDocument')
+                if spot is not None and 'spotId' in spot:
+                    self._apply_spot_document(spot)
+                else:
+                    # Deletes only carry the _id, reload to stay correct
+                    self.load_reservations()
+
+    def _poll_reservations(self):
+        next_sweep = time.monotonic() + REFUND_SWEEP_INTERVAL
+        while not self._stop_event.wait(self.reservation_poll_interval):
+            try:
+                self.load_reservations()
+            except PyMongoError as e:
+                print(f"Failed to refresh reservations: {e}")
+            if time.monotonic() >= next_sweep:
+                self._sweep_pending_refunds()
+                next_sweep = time.monotonic() + REFUND_SWEEP_INTERVAL
 
     def add_user(self, username, password, phone=None, initial_balance=0):
         hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
@@ -17,26 +335,41 @@ class Database:
         if phone:
             user_data["phone"] = phone
         self.users.insert_one(user_data)
+        self._cache_user(user_data)
         return True  # Indicate successful addition
     
     def change_username_password(self, current_username, new_username, new_password):
-        user_data = self.get_user(current_username)
+        # Hash the new password
+        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
 
-        if user_data:
-            # Hash the new password
-            hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        # Update the username and password, matched_count tells whether the user exists
+        result = self.users.update_one(
+            {"username": current_username},
+            {"$set": {"username": new_username, "password": hashed_password}}
+        )
+        self.invalidate_user(current_username)
+        self.invalidate_user(new_username)
+        return result.matched_count > 0
 
-            # Update the username and password
-            self.users.update_one(
-                {"username": current_username},
-                {"$set": {"username": new_username, "password": hashed_password}}
-            )
-            return True
-        else:
-            return False
+    def _cache_user(self, user_data):
+        if user_data is None:
+            return
+        with self._user_cache_lock:
+            self._user_cache[user_data['username']] = (user_data, time.monotonic())
+
+    def invalidate_user(self, username):
+        with self._user_cache_lock:
+            self._user_cache.pop(username, None)
 
-    def get_user(self, username):
-        return self.users.find_one({"username": username})
+    def get_user(self, username, use_cache=True):
+        if use_cache:
+            with self._user_cache_lock:
+                cached = self._user_cache.get(username)
+            if cached and time.monotonic() - cached[1] < self.user_cache_ttl:
+                return dict(cached[0])
+        user_data = self.users.find_one({"username": username})
+        self._cache_user(user_data)
+        return user_data
     
     def get_user_balance(self, username):
         user_data = self.get_user(username)
@@ -45,41 +378,94 @@ class Database:
         return 0    
 
     def user_exists(self, username):
-        return self.users.find_one({"username": username}) is not None
+        return self.get_user(username) is not None
 
     def validate_login(self, username, password):
-        user_data = self.get_user(username)
+        # Credentials are always checked against the stored document, not the cache
+        user_data = self.get_user(username, use_cache=False)
         if user_data and bcrypt.checkpw(password.encode('utf-8'), user_data['password']):
             return True
         return False
 
+    def authenticate(self, username, password):
+        # One bcrypt check per login attempt. On success returns a session token;
+        # the session keeps the user document so screens need not fetch it again
+        user_data = self.get_user(username, use_cache=False)
+        if not user_data or not bcrypt.checkpw(password.encode('utf-8'), user_data['password']):
+            return None
+        user_data = {key: value for key, value in user_data.items() if key != 'password'}
+        token = secrets.token_urlsafe(32)
+        with self._sessions_lock:
+            self._sessions[token] = {
+                "username": username,
+                "user": user_data,
+                "expiresAt": datetime.datetime.now() + SESSION_TTL
+            }
+        return token
+
+    def get_session(self, token):
+        with self._sessions_lock:
+            session = self._sessions.get(token)
+            if session and session['expiresAt'] <= datetime.datetime.now():
+                del self._sessions[token]
+                session = None
+        return session
+
+    def end_session(self, token):
+        with self._sessions_lock:
+            self._sessions.pop(token, None)
+
     def get_all_reserved_spots(self):
-        reserved_spots = self.parking_spots.find({"isReserved": True}, {"spotId": 1, "_id": 0})
-        return [spot['spotId'] for spot in reserved_spots]
+        # Served from memory, this is called for every rendered frame
+        with self._reservations_lock:
+            return list(self._reservations)
     
     def get_user_reservations(self, username):
-        user_reservations = self.parking_spots.find({"reservedBy": username}, {"spotId": 1, "_id": 0})
-        return [int(reservation['spotId']) for reservation in user_reservations]
-
+        with self._reservations_lock:
+            return sorted(spot_id for spot_id, reservation in self._reservations.items()
+                          if reservation['reservedBy'] == username)
 
-    def reserve_parking_spot(self, username, spot_id):
-        spot_id = int(spot_id)
-        if self.parking_spots.find_one({"spotId": spot_id, "isReserved": True}):
-            return False
 
+    def _claim_spot(self, username, spot_id):
+        # Single conditional upsert: it only matches a spot that is not reserved.
+        # If the spot is taken the upsert collides with the unique spotId index.
         reservation_time = datetime.datetime.now()
         expiration_time = reservation_time + datetime.timedelta(seconds=10)
+        try:
+            self.parking_spots.update_one(
+                {"spotId": spot_id, "isReserved": {"$ne": True}},
+                {"$set": {
+                    "isReserved": True,
+                    "reservedBy": username,
+                    "reservationTime": reservation_time,
+                    "expirationTime": expiration_time
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        self._cache_reservation(spot_id, username, expiration_time)
+        return True
 
-        self.parking_spots.update_one(
-            {"spotId": spot_id},
-            {"$set": {
-                "isReserved": True,
-                "reservedBy": username,
-                "reservationTime": reservation_time,
-                "expirationTime": expiration_time
-            }},
-            upsert=True
+    def _release_spot(self, username, spot_id, pending_refund=None):
+        # pending_refund is recorded on the spot in the same atomic update, so a
+        # released spot always carries the refund it still owes
+        update = {"isReserved": False, "reservedBy": None, "reservationTime": None, "expirationTime": None}
+        if pending_refund is not None:
+            update["pendingRefund"] = pending_refund
+        spot = self.parking_spots.find_one_and_update(
+            {"spotId": spot_id, "reservedBy": username, "isReserved": True},
+            {"$set": update}
         )
+        if spot is None:
+            return False
+        self._uncache_reservation(spot_id)
+        return True
+
+    def reserve_parking_spot(self, username, spot_id):
+        spot_id = int(spot_id)
+        if not self._claim_spot(username, spot_id):
+            return False
 
         user_data = self.get_user(username)
         if user_data and 'phone' in user_data:
@@ -89,52 +475,156 @@ class Database:
     
     def unreserve_parking_spot(self, username, spot_id):
         spot_id = int(spot_id)
-        spot = self.parking_spots.find_one({"spotId": spot_id, "reservedBy": username})
-        if spot and spot['isReserved']:
-            self.parking_spots.update_one(
-                {"spotId": spot_id},
-                {"$set": {"isReserved": False, "reservedBy": None, "reservationTime": None, "expirationTime": None}}
-            )
+        if self._release_spot(username, spot_id):
             user_data = self.get_user(username)
             if user_data and 'phone' in user_data:
                 self.send_sms_notification(user_data['phone'], f"You have successfully unreserved parking spot number {spot_id}.")
             return True
         return False
+
+    def expire_reservation(self, spot_id):
+        # Only matches while the reservation is still active and past its
+        # expirationTime, so it succeeds once across every running kiosk.
+        # Returns the user whose reservation was released, or None.
+        spot_id = int(spot_id)
+        spot = self.parking_spots.find_one_and_update(
+            {"spotId": spot_id, "isReserved": True, "expirationTime": {"$lte": datetime.datetime.now()}},
+            {"$set": {"isReserved": False, "reservedBy": None, "reservationTime": None, "expirationTime": None}}
+        )
+        if spot is None:
+            return None
+        self._uncache_reservation(spot_id)
+        user_data = self.get_user(spot['reservedBy'])
+        if user_data and 'phone' in user_data:
+            self.send_sms_notification(user_data['phone'], f"Your reservation for parking spot number {spot_id} has expired.")
+        return spot['reservedBy']
+
+    def reserve_and_charge(self, username, spot_id, cost=RESERVATION_COST):
+        # Debit, then claim the spot, each one atomic round trip. The debit only
+        # matches while the balance covers the cost. If the spot turns out to be
+        # taken the debit is compensated, so concurrent kiosks can neither
+        # double-book a spot nor lose a balance update.
+        spot_id = int(spot_id)
+        user_data = self.users.find_one_and_update(
+            {"username": username, "balance": {"$gte": cost}},
+            {"$inc": {"balance": -cost}},
+            return_document=ReturnDocument.AFTER
+        )
+        if user_data is None:
+            return RESERVE_INSUFFICIENT_FUNDS
+        self._cache_user(user_data)
+
+        try:
+            claimed = self._claim_spot(username, spot_id)
+        except Exception:
+            # The claim may or may not have been applied (network error, timeout,
+            # write concern); refund unless the spot ended up reserved for us
+            if not self._holds_spot(username, spot_id):
+                self._refund(username, cost)
+            raise
+        if not claimed:
+            self._refund(username, cost)
+            return RESERVE_TAKEN
+
+        if 'phone' in user_data:
+            self.send_sms_notification(user_data['phone'], f"You have successfully reserved parking spot number {spot_id}. It expires in 3 minutes.")
+        return RESERVE_OK
+
+    def _refund(self, username, amount):
+        self._cache_user(self.users.find_one_and_update(
+            {"username": username},
+            {"$inc": {"balance": amount}},
+            return_document=ReturnDocument.AFTER
+        ))
+
+    def _holds_spot(self, username, spot_id):
+        # Best effort, when the database cannot answer the user gets the refund
+        try:
+            return self.parking_spots.find_one(
+                {"spotId": spot_id, "reservedBy": username, "isReserved": True}) is not None
+        except PyMongoError:
+            return False
+
+    def unreserve_and_refund(self, username, spot_id, refund=RESERVATION_COST):
+        # The release records the refund on the spot, then the refund is applied
+        # idempotently. If it keeps failing the spot still owes it and the
+        # reservation sync thread applies it later, so the fee is never lost.
+        spot_id = int(spot_id)
+        pending_refund = {"refundId": secrets.token_hex(8), "username": username, "amount": refund}
+        if not self._release_spot(username, spot_id, pending_refund):
+            return False
+
+        user_data = None
+        for attempt in range(REFUND_RETRIES):
+            try:
+                user_data = self._apply_refund(spot_id, pending_refund)
+                break
+            except PyMongoError as e:
+                if attempt == REFUND_RETRIES - 1:
+                    print(f"Refund for spot {spot_id} failed, it will be retried later: {e}")
+                else:
+                    time.sleep(0.5 * 2 ** attempt)
+        if user_data and 'phone' in user_data:
+            self.send_sms_notification(user_data['phone'], f"You have successfully unreserved parking spot number {spot_id}.")
+        return True
     
-    def send_sms_notification(self, user_phone, message_body):
-        account_sid = 'AC2ea1c971ea162d98295bf49cbb1a984f'
-        auth_token = 'a1284fed6431c233d1c0b59849dad731'
-        client = Client(account_sid, auth_token)
-        twilio_number = '+18667262459'  # Ensure the number is in E.164 format
+    def _apply_refund(self, spot_id, pending_refund):
+        # Applied at most once: the user document remembers the last refund ids
+        refund_id = pending_refund["refundId"]
+        user_data = self.users.find_one_and_update(
+            {"username": pending_refund["username"], "refundIds": {"$ne": refund_id}},
+            {"$inc": {"balance": pending_refund["amount"]},
+             "$push": {"refundIds": {"$each": [refund_id], "$slice": -20}}},
+            return_document=ReturnDocument.AFTER
+        )
+        if user_data is not None:
+            self._cache_user(user_data)
+        self.parking_spots.update_one(
+            {"spotId": spot_id, "pendingRefund.refundId": refund_id}, {"$unset": {"pendingRefund": ""}})
+        return user_data
+
+    def _sweep_pending_refunds(self):
         try:
-            message = client.messages.create(
-                body=message_body,
-                from_=twilio_number,
-                to=user_phone
-            )
-            print(f"Message sent: {message.sid}")
-        except Exception as e:
-            print(f"Failed to send SMS: {e}")
+            for spot in self.parking_spots.find({"pendingRefund.refundId": {"$exists": True}},
+                                                {"spotId": 1, "pendingRefund": 1, "_id": 0}):
+                self._apply_refund(spot["spotId"], spot["pendingRefund"])
+        except PyMongoError as e:
+            print(f"Failed to apply pending refunds: {e}")
+
+    def send_sms_notification(self, user_phone, message_body):
+        # Queued, delivery happens on the dispatcher's worker threads
+        self.notifier.send_sms(user_phone, message_body)
             
     def get_remaining_time(self, spot_id):
-        spot = self.parking_spots.find_one({"spotId": int(spot_id)})
-        if spot and spot.get('isReserved') and 'expirationTime' in spot:
-            remaining = spot['expirationTime'] - datetime.datetime.now()
-            if remaining.total_seconds() > 0:
-                return int(remaining.total_seconds())
-            else:
-                # Unreserve the spot if expired
-                self.unreserve_parking_spot(spot['reservedBy'], spot_id)
-                return 0  # Return 0 to indicate expiration
-        return 0  # Return 0 if spot isn't reserved or doesn't exist
+        # Read from the reservation cache, releasing expired spots is the job of
+        # the expiry service
+        with self._reservations_lock:
+            reservation = self._reservations.get(int(spot_id))
+        if reservation and reservation['expirationTime'] is not None:
+            remaining = reservation['expirationTime'] - datetime.datetime.now()
+            return max(int(remaining.total_seconds()), 0)
+        return 0  # Return 0 if spot isn't reserved, doesn't exist or has expired
 
     def update_account_balance(self, username, amount):
-        # Fetch the user's current balance
-        current_balance = self.users.find_one({"username": username})['balance']
-        # Update the balance with the new amount
-        new_balance = current_balance + amount
-        self.users.update_one({"username": username}, {"$set": {"balance": new_balance}})
+        # $inc is applied atomically on the server, concurrent updates are not lost.
+        # The updated document refreshes the user cache.
+        self._cache_user(self.users.find_one_and_update(
+            {"username": username},
+            {"$inc": {"balance": amount}},
+            return_document=ReturnDocument.AFTER
+        ))
         return True  # Indicate successful balance update
 
 
-    
+if __name__ == '__main__':
+    if '--dedupe' in sys.argv:
+        config = load_database_config()
+        deduplicate(get_client(config)[config["database"]])
+        sys.exit(0)
+    db = Database()
+    unindexed = db.check_indexes()
+    if unindexed:
+        print("Queries not using an index: " + ", ".join(unindexed))
+    else:
+        print("All hot queries use an index.")
+    db.close()
@@ -0,0 +1,55 @@
+import threading
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class DetectionWorker(QThread):
+    # Emitted with (spot_status, car_detections) after every inference pass
+    occupancy_ready = pyqtSignal(object, object)
+    # Emitted with [(spot_idx, occupied), ...] only when a spot changed state
+    spots_changed = pyqtSignal(object)
+
+    def __init__(self, detector, parent=None):
+        super().__init__(parent)
+        self.detector = detector
+        self._frame = None
+        self._busy = False
+        self._running = True
+        self._condition = threading.Condition()
+
+    def submit(self, frame):
+        # Only the newest frame is kept, a frame that was not picked up yet is dropped
+        with self._condition:
+            self._frame = frame
+            self._condition.notify()
+
+    def is_busy(self):
+        with self._condition:
+            return self._busy or self._frame is not None
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and self._frame is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                frame, self._frame = self._frame, None
+                self._busy = True
+
+            try:
+                if not self.detector.run_detection(frame):
+                    continue
+                self.occupancy_ready.emit(self.detector.spot_status, self.detector.car_detections)
+                if self.detector.spot_changes:
+                    self.spots_changed.emit(self.detector.spot_changes)
+            except Exception as e:
+                print(f"Detection failed: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
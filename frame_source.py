@@ -0,0 +1,289 @@
+import collections
+import glob
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+
+# Entry points fall back to this when no source is given on the command line
+VIDEO_SOURCE_ENV = 'FINDMYSPOT_VIDEO_SOURCE'
+STREAM_SCHEMES = ('rtsp', 'rtsps', 'rtmp', 'http', 'https', 'udp', 'tcp')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Every source has read(image=None) -> (ret, frame) and decodes into image when
+# it has the right shape, rewind() to start over (reconnect, for streams),
+# release(), and fps / live attributes.
+
+
+class VideoFileSource:
+    live = False
+
+    def __init__(self, path):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video file: {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+
+    def read(self, image=None):
+        return self.capture.read(image)
+
+    def rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        self.capture.release()
+
+
+class StreamSource:
+    # Network streams (RTSP, HTTP, ...) and local cameras by index
+    live = True
+
+    def __init__(self, url, reconnect_delay=1.0):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.capture = cv2.VideoCapture(url)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video stream: {url}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+
+    def read(self, image=None):
+        return self.capture.read(image)
+
+    def rewind(self):
+        print(f"Video stream {self.url} ended, reconnecting")
+        self.capture.release()
+        time.sleep(self.reconnect_delay)
+        self.capture = cv2.VideoCapture(self.url)
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirectorySource:
+    # Still images in file name order, played back as a video
+    live = False
+
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.fps = fps
+        self.files = sorted(f for f in glob.glob(os.path.join(path, '*')) if f.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.files:
+            raise ValueError(f"No images found in {path}")
+        self.index = 0
+
+    def read(self, image=None):
+        while self.index < len(self.files):
+            frame = cv2.imread(self.files[self.index])
+            self.index += 1
+            if frame is None:
+                print(f"Warning: could not read image {self.files[self.index - 1]}")
+                continue
+            if image is not None and image.shape == frame.shape:
+                np.copyto(image, frame)
+                return True, image
+            return True, frame
+        return False, None
+
+    def rewind(self):
+        self.index = 0
+
+    def release(self):
+        pass
+
+
+class SyntheticSource:
+    # Deterministic test feed: a fixed textured background with car-sized boxes
+    # driving across it. The same arguments give the same frames on every run,
+    # so throughput can be measured reproducibly without real footage.
+    live = False
+
+    def __init__(self, width=1920, height=1080, car_count=12, frame_count=None, seed=0, fps=30.0):
+        self.width = width
+        self.height = height
+        self.frame_count = frame_count
+        self.fps = fps
+        rng = np.random.default_rng(seed)
+        background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+        self.background = cv2.GaussianBlur(background, (0, 0), 3)
+        sizes = rng.uniform(0.06, 0.1, (car_count, 1)) * width * np.array([1.0, 0.55])
+        self._sizes = sizes.astype(int)
+        self._starts = rng.uniform(0, 1, (car_count, 2)) * np.array([width, height - sizes[:, 1].max()])
+        self._speeds = rng.uniform(-8, 8, car_count)
+        self._colors = [tuple(color) for color in rng.integers(0, 256, (car_count, 3)).tolist()]
+        self.index = 0
+
+    def boxes(self, index):
+        # Ground truth (x1, y1, x2, y2) of every car in frame index
+        span = self.width + self._sizes[:, 0]
+        x1 = (self._starts[:, 0] + self._speeds * index) % span - self._sizes[:, 0]
+        y1 = self._starts[:, 1]
+        return np.stack([x1, y1, x1 + self._sizes[:, 0], y1 + self._sizes[:, 1]], axis=1).astype(int)
+
+    def read(self, image=None):
+        if self.frame_count is not None and self.index >= self.frame_count:
+            return False, None
+        if image is None or image.shape != self.background.shape:
+            image = np.empty_like(self.background)
+        np.copyto(image, self.background)
+        for (x1, y1, x2, y2), color in zip(self.boxes(self.index).tolist(), self._colors):
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, -1)
+        self.index += 1
+        return True, image
+
+    def rewind(self):
+        self.index = 0
+
+    def release(self):
+        pass
+
+
+class ThreadedFrameSource:
+    # Decodes on a background thread into a ring of preallocated frames, so a
+    # slow or uneven decode never blocks the caller. read() hands out one slot
+    # at a time; the frame it returns stays valid until the next read() and is
+    # then reused, so callers that keep a frame longer must copy it.
+    #
+    # latest_only=False (files): every frame is delivered in order and decoding
+    # pauses while the ring is full.
+    # latest_only=True (live cameras): decoding never waits, the oldest unread
+    # frame is overwritten and read() always gets the newest one.
+    # loop=True rewinds on the decode thread at the end (reconnects, for
+    # streams), the frames already in the ring cover the seek.
+    def __init__(self, source, buffer_size=4, latest_only=False, loop=False):
+        self.source = source
+        self.buffer_size = max(buffer_size, 2)
+        self.latest_only = latest_only
+        self.loop = loop
+        self.finished = False
+        self._slots = [None] * self.buffer_size
+        self._free = collections.deque(range(self.buffer_size))
+        self._ready = collections.deque()
+        self._held = None
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='FrameDecode', daemon=True)
+        self._thread.start()
+
+    @property
+    def fps(self):
+        return self.source.fps
+
+    def is_opened(self):
+        with self._condition:
+            return self._running and not (self.finished and not self._ready)
+
+    def read(self, timeout=None):
+        # Returns (ret, frame) like VideoCapture.read. timeout=0 never waits;
+        # ret is False when no frame is ready yet or the source has ended.
+        with self._condition:
+            if self._held is not None:
+                self._free.append(self._held)
+                self._held = None
+                self._condition.notify_all()
+            if not self._ready and timeout != 0:
+                self._condition.wait_for(lambda: self._ready or self.finished or not self._running, timeout)
+            if not self._ready:
+                return False, None
+            if self.latest_only:
+                # Frames older than the newest one are skipped, not queued up
+                while len(self._ready) > 1:
+                    self._free.append(self._ready.popleft())
+                self._condition.notify_all()
+            self._held = self._ready.popleft()
+            return True, self._slots[self._held]
+
+    def release(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self.source.release()
+
+    def _next_slot(self):
+        with self._condition:
+            if not self.latest_only:
+                self._condition.wait_for(lambda: self._free or not self._running)
+            elif not self._free:
+                # Drop the oldest frame nobody has read
+                self._free.append(self._ready.popleft())
+            if not self._running:
+                return None
+            return self._free.popleft()
+
+    def _decode(self, slot):
+        ret, frame = self.source.read(self._slots[slot])
+        if not ret and self.loop:
+            self.source.rewind()
+            ret, frame = self.source.read(self._slots[slot])
+        return ret, frame
+
+    def _run(self):
+        while True:
+            slot = self._next_slot()
+            if slot is None:
+                return
+            try:
+                ret, frame = self._decode(slot)
+            except Exception as e:
+                print(f"Frame decode failed: {e}")
+                ret, frame = False, None
+            with self._condition:
+                if not ret:
+                    self._free.append(slot)
+                    self.finished = True
+                    self._condition.notify_all()
+                    return
+                # Sources decode into the slot in place once its size is known
+                self._slots[slot] = frame
+                self._ready.append(slot)
+                self._condition.notify_all()
+
+
+def open_source(uri):
+    # 'synthetic://1920x1080?cars=12&frames=300&seed=0', 'rtsp://...', a camera
+    # index like '0', a directory of images or a video file
+    uri = str(uri)
+    parsed = urlparse(uri)
+    if parsed.scheme == 'synthetic':
+        options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        width, height = map(int, (parsed.netloc or '1920x1080').lower().split('x'))
+        frames = options.get('frames')
+        return SyntheticSource(width, height, car_count=int(options.get('cars', 12)),
+                               frame_count=int(frames) if frames else None, seed=int(options.get('seed', 0)),
+                               fps=float(options.get('fps', 30.0)))
+    if parsed.scheme in STREAM_SCHEMES:
+        return StreamSource(uri)
+    if uri.isdigit():
+        return StreamSource(int(uri))
+    if os.path.isdir(uri):
+        return ImageDirectorySource(uri)
+    return VideoFileSource(uri)
+
+
+def open_frame_source(uri, buffer_size=4, latest_only=None, loop=False):
+    # Any source behind the background decoder; live sources default to
+    # latest_only, everything else is played in order
+    source = uri if hasattr(uri, 'read') else open_source(uri)
+    if latest_only is None:
+        latest_only = source.live
+    return ThreadedFrameSource(source, buffer_size=buffer_size, latest_only=latest_only, loop=loop)
+
+
+def default_source(fallback):
+    return os.environ.get(VIDEO_SOURCE_ENV, fallback)
+
+
+if __name__ == '__main__':
+    # Decode throughput of a source, e.g. python frame_source.py synthetic://1280x720?frames=600
+    frames = open_frame_source(sys.argv[1] if len(sys.argv) > 1 else default_source('example.mp4'))
+    count = 0
+    start = time.monotonic()
+    while frames.read()[0]:
+        count += 1
+    elapsed = time.monotonic() - start
+    frames.release()
+    print(f"{count} frames in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.1f} fps)")
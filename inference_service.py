@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceRequest:
+    def __init__(self, frame, conf, iou):
+        self.frame = frame
+        self.conf = conf
+        self.iou = iou
+        self.future = Future()
+
+
+class InferenceService:
+    # One model shared by several detectors/cameras. Frames submitted from any
+    # thread are collected into batches and run as a single model call. A batch is
+    # held open for at most max_wait_ms and never grows past max_batch_size, so
+    # latency stays bounded while throughput goes up with the number of cameras.
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='InferenceService', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, conf=0.25, iou=0.7):
+        # Returns a Future resolving to the raw (N, 6) detections for the frame
+        if self._closed:
+            raise RuntimeError("InferenceService is closed")
+        request = InferenceRequest(frame, conf, iou)
+        self._queue.put(request)
+        return request.future
+
+    def infer(self, frame, conf=0.25, iou=0.7):
+        return self.submit(frame, conf, iou).result()
+
+    def infer_many(self, frames, conf=0.25, iou=0.7):
+        futures = [self.submit(frame, conf, iou) for frame in frames]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def _collect_batch(self):
+        # Blocks for the first request, then waits up to max_wait_ms for more.
+        # Returns (batch, keep_running)
+        first = self._queue.get()
+        if first is None:
+            return [], False
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, False
+            batch.append(request)
+        return batch, True
+
+    def _run(self):
+        running = True
+        while running:
+            batch, running = self._collect_batch()
+            # Thresholds are per call, so requests with different ones are split
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.conf, request.iou), []).append(request)
+            for (conf, iou), requests in groups.items():
+                self._run_group(requests, conf, iou)
+
+    def _run_group(self, requests, conf, iou):
+        try:
+            results = self.model([request.frame for request in requests], conf=conf, iou=iou)
+            for request, result in zip(requests, results):
+                request.future.set_result(result.boxes.data.cpu().numpy())
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
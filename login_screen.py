@@ -1,11 +1,12 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton
-from twilio.rest import Client
+from async_db import get_async_database
 
 class LoginScreen(QWidget):
     def __init__(self, stacked_widget, db, widget_indices):
         super().__init__()
         self.stacked_widget = stacked_widget
         self.db = db
+        self.async_db = get_async_database(db)
         self.widget_indices = widget_indices
         self.initUI()
 
@@ -38,7 +39,18 @@ class LoginScreen(QWidget):
     def login(self):
         username = self.username_input.text()
         password = self.password_input.text()
-        if self.db.validate_login(username, password):
+        self.login_button.setEnabled(False)
+        self.login_status_label.setText('Logging in...')
+        self.async_db.authenticate(
+            username, password,
+            on_result=lambda token: self.finish_login(username, token),
+            on_error=self.show_request_error
+        )
+
+    def finish_login(self, username, token):
+        self.login_button.setEnabled(True)
+        session = self.db.get_session(token) if token else None
+        if session:
             self.login_status_label.setText('')
 
             payment_screen = self.stacked_widget.widget(5)
@@ -51,20 +63,18 @@ class LoginScreen(QWidget):
             main_window.set_current_user(username)  # Set the current user in MainWindow
 
             dashboard_screen = self.stacked_widget.widget(1)
-            dashboard_screen.set_current_user(username)
-            dashboard_screen.update_dashboard()
+            dashboard_screen.set_session(token, session)
 
             self.stacked_widget.setCurrentIndex(1)
             self.clearInputs()
             
         else:
             self.login_status_label.setText('Invalid username or password')
-        if self.db.validate_login(username, password):
-            self.login_status_label.setText('')
-            self.stacked_widget.setCurrentIndex(1)
-            self.clearInputs()
-        else:
-            self.login_status_label.setText('Invalid username or password')
+
+    def show_request_error(self, error):
+        self.login_button.setEnabled(True)
+        self.register_button.setEnabled(True)
+        self.login_status_label.setText(f'Could not reach the server: {error}')
 
     def register(self):
         username = self.username_input.text()
@@ -79,30 +89,35 @@ class LoginScreen(QWidget):
             self.login_status_label.setText("Password must be at least 4 characters long")
             return
 
-        if self.db.user_exists(username):
+        self.register_button.setEnabled(False)
+        self.async_db.user_exists(
+            username,
+            on_result=lambda exists: self.continue_register(username, password, phone, exists),
+            on_error=self.show_request_error
+        )
+
+    def continue_register(self, username, password, phone, exists):
+        if exists:
+            self.register_button.setEnabled(True)
             self.login_status_label.setText("Username already exists")
             return
 
-        if self.db.add_user(username, password, phone):
+        self.async_db.add_user(
+            username, password, phone,
+            on_result=lambda added: self.finish_register(phone, added),
+            on_error=self.show_request_error
+        )
+
+    def finish_register(self, phone, added):
+        self.register_button.setEnabled(True)
+        if added:
             self.login_status_label.setText("Registration successful")
             self.send_sms_notification(phone)  # Send SMS notification
             self.clearInputs()
 
     def send_sms_notification(self, user_phone):
-        account_sid = 'AC2ea1c971ea162d98295bf49cbb1a984f'
-        auth_token = 'a1284fed6431c233d1c0b59849dad731'
-        client = Client(account_sid, auth_token)
-        twilio_number = '+18667262459'  # Ensure the number is in E.164 format
         message_body = 'Welcome! Thank you for registering with FindMySpot.'
-        try:
-            message = client.messages.create(
-                body=message_body,
-                from_=twilio_number,
-                to=user_phone
-            )
-            print(f"Message sent: {message.sid}")
-        except Exception as e:
-            print(f"Failed to send SMS: {e}")
+        self.db.send_sms_notification(user_phone, message_body)
     def clearInputs(self):
         self.username_input.clear()
         self.password_input.clear()
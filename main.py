@@ -67,5 +67,10 @@ class MainApp(QApplication):
             self.setStyleSheet(file.read())
 
 if __name__ == '__main__':
-    app = MainApp(sys.argv)
+    try:
+        app = MainApp(sys.argv)
+    except RuntimeError as e:
+        # e.g. MongoDB unreachable or its unique indexes missing
+        print(f"Error: {e}")
+        sys.exit(1)
     sys.exit(app.exec_())
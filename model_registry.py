@@ -0,0 +1,42 @@
+import threading
+from inference_service import InferenceService
+
+_lock = threading.Lock()
+_models = {}
+_services = {}
+
+
+class SharedModel:
+    # A YOLO model shared by every detector in the process. Calls are
+    # serialized because predictor state is not safe to use from two threads.
+    def __init__(self, weights_path):
+        # Imported here so starting the app does not pay for importing ultralytics
+        from ultralytics import YOLO
+        self.weights_path = weights_path
+        self.model = YOLO(weights_path)
+        self._call_lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._call_lock:
+            return self.model(*args, **kwargs)
+
+
+def get_model(weights_path):
+    # Loads each weights file once, the first time something asks for it
+    with _lock:
+        model = _models.get(weights_path)
+        if model is None:
+            print(f"Loading model weights: {weights_path}")
+            model = SharedModel(weights_path)
+            _models[weights_path] = model
+        return model
+
+
+def get_inference_service(weights_path, max_batch_size=8, max_wait_ms=20):
+    model = get_model(weights_path)
+    with _lock:
+        service = _services.get(weights_path)
+        if service is None:
+            service = InferenceService(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+            _services[weights_path] = service
+        return service
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+class TwilioTransport:
+    # One Twilio client for the whole process, created on the first message.
+    # Credentials come from the arguments or the TWILIO_* environment variables.
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        self.account_sid = account_sid or os.environ.get('TWILIO_ACCOUNT_SID')
+        self.auth_token = auth_token or os.environ.get('TWILIO_AUTH_TOKEN')
+        self.from_number = from_number or os.environ.get('TWILIO_FROM_NUMBER')  # E.164 format
+        self._client = None
+        self._lock = threading.Lock()
+
+    def is_configured(self):
+        return bool(self.account_sid and self.auth_token and self.from_number)
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                from twilio.rest import Client
+                self._client = Client(self.account_sid, self.auth_token)
+            return self._client
+
+    def send(self, to, body):
+        message = self._get_client().messages.create(body=body, from_=self.from_number, to=to)
+        return message.sid
+
+
+class StubTransport:
+    # Keeps messages in memory instead of sending them, for local runs and load tests
+    def __init__(self, latency=0.0, verbose=True):
+        self.latency = latency
+        self.verbose = verbose
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((to, body))
+            sid = f"stub-{len(self.sent)}"
+        if self.verbose:
+            print(f"[stub sms] to {to}: {body}")
+        return sid
+
+
+class NotificationDispatcher:
+    # SMS goes through a bounded queue drained by worker threads, so callers never
+    # wait on the network. Failed sends are retried with exponential backoff. An
+    # identical message to the same number within dedupe_seconds is dropped; the
+    # window only covers bursts (double clicks, repeated callbacks), a user
+    # repeating an action a few seconds later still gets their SMS.
+    def __init__(self, transport=None, workers=2, max_queue=1000, max_retries=3,
+                 backoff_seconds=1.0, dedupe_seconds=2.0):
+        self.transport = transport if transport is not None else default_transport()
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.dedupe_seconds = dedupe_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._recent = {}
+        self._recent_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f'NotificationWorker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def send_sms(self, to, body):
+        # Returns False when the message was a duplicate or the queue was full
+        now = time.monotonic()
+        key = (to, body)
+        with self._recent_lock:
+            if self._is_duplicate(key, now):
+                return False
+            try:
+                self._queue.put_nowait((to, body))
+            except queue.Full:
+                print(f"Notification queue full, dropping SMS to {to}")
+                return False
+            # Only recorded once queued, so a dropped message can be sent again
+            self._recent[key] = now
+            if len(self._recent) > 1000:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedupe_seconds}
+        return True
+
+    def _is_duplicate(self, key, now):
+        last_sent = self._recent.get(key)
+        return last_sent is not None and now - last_sent < self.dedupe_seconds
+
+    def wait_until_sent(self):
+        self._queue.join()
+
+    def close(self):
+        self.wait_until_sent()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._deliver(*item)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, to, body):
+        for attempt in range(self.max_retries + 1):
+            try:
+                sid = self.transport.send(to, body)
+                print(f"Message sent: {sid}")
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Failed to send SMS: {e}")
+                    return
+                time.sleep(self.backoff_seconds * 2 ** attempt)
+
+
+def default_transport():
+    # FINDMYSPOT_SMS_TRANSPORT=stub sends nothing to the outside world, and
+    # neither does a missing Twilio configuration
+    if os.environ.get('FINDMYSPOT_SMS_TRANSPORT', 'twilio').lower() == 'stub':
+        return StubTransport()
+    transport = TwilioTransport()
+    if not transport.is_configured():
+        print("Twilio credentials not set (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER), "
+              "SMS will only be logged")
+        return StubTransport()
+    return transport
+
+
+def get_dispatcher():
+    # Shared by every screen and Database in the process
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+        return _dispatcher
@@ -0,0 +1,411 @@
+import time
+import cv2
+import numpy as np
+
+
+class SpotGridIndex:
+    # Uniform grid over the spot bounds. Each cell lists the spots whose bounds
+    # touch it, so a car box only has to be scored against spots in its cells.
+    def __init__(self, cell_size):
+        self.cell_size = max(int(cell_size), 1)
+        self.cells = {}
+        self.spot_cells = {}
+
+    def _cells_for(self, bounds):
+        x1, y1, x2, y2 = (int(coord // self.cell_size) for coord in bounds)
+        return [(cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1)]
+
+    def rebuild(self, bounds):
+        self.cells = {}
+        self.spot_cells = {}
+        for spot_idx, spot_bounds in enumerate(bounds):
+            self.insert(spot_idx, spot_bounds)
+
+    def insert(self, spot_idx, bounds):
+        cells = self._cells_for(bounds)
+        self.spot_cells[spot_idx] = cells
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(spot_idx)
+
+    def remove(self, spot_idx):
+        for cell in self.spot_cells.pop(spot_idx, []):
+            members = self.cells[cell]
+            members.discard(spot_idx)
+            if not members:
+                del self.cells[cell]
+
+    def update(self, spot_idx, bounds):
+        self.remove(spot_idx)
+        self.insert(spot_idx, bounds)
+
+    def delete(self, spot_idx):
+        # Removes a spot and shifts the ids after it down by one, matching list.pop
+        self.remove(spot_idx)
+        shifted = sorted(idx for idx in self.spot_cells if idx > spot_idx)
+        for idx in shifted:
+            cells = self.spot_cells.pop(idx)
+            self.spot_cells[idx - 1] = cells
+            for cell in cells:
+                self.cells[cell].discard(idx)
+                self.cells[cell].add(idx - 1)
+
+    def query(self, box):
+        candidates = set()
+        for cell in self._cells_for(box):
+            candidates.update(self.cells.get(cell, ()))
+        return candidates
+
+    def query_pairs(self, boxes):
+        car_idx, spot_idx = [], []
+        # Plain floats, numpy scalar arithmetic is far slower in this loop
+        for i, box in enumerate(np.asarray(boxes).tolist()):
+            candidates = self.query(box)
+            car_idx.extend([i] * len(candidates))
+            spot_idx.extend(candidates)
+        return np.array(car_idx, dtype=np.int64), np.array(spot_idx, dtype=np.int64)
+
+
+class SpotOccupancyEngine:
+    # Scores car boxes against spots with array ops. Spot bounds and areas are
+    # computed once when the spots are loaded, not per frame.
+    #
+    # 'bbox' mode compares against each spot's bounding box. 'exact' mode uses the
+    # fraction of the spot polygon covered by the car box, read from a per-spot
+    # integral image rasterized at raster_scale when the spots are loaded.
+    #
+    # Lots with at least index_min_spots spots get a SpotGridIndex, and only the
+    # spots sharing a grid cell with a box are scored.
+    MODES = ('bbox', 'exact')
+
+    def __init__(self, spots, threshold=0.5, mode='bbox', raster_scale=1.0,
+                 index_min_spots=64, index_cell_size=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown occupancy mode: {mode}")
+        self.threshold = threshold
+        self.mode = mode
+        self.raster_scale = raster_scale
+        self.index_min_spots = index_min_spots
+        self.index_cell_size = index_cell_size
+        self.index = None
+        self.set_spots(spots)
+
+    def set_spots(self, spots):
+        coords = np.asarray(spots, dtype=np.float64).reshape(-1, 4, 2)
+        self.spot_count = len(coords)
+        self.bounds, self.bounds_area = self._geometry(coords)
+        if self.mode == 'exact':
+            rasters = [self._rasterize(pts) for pts in coords]
+            self.raster_origin = np.array([r[0] for r in rasters], dtype=np.int64).reshape(-1, 2)
+            self.raster_size = np.array([r[1] for r in rasters], dtype=np.int64).reshape(-1, 2)
+            self._tables = [r[2] for r in rasters]
+            self._pack_rasters()
+        self._build_index()
+
+    def add_spot(self, spot):
+        self._insert_spot(self.spot_count, spot)
+
+    def update_spot(self, spot_idx, spot):
+        coords = np.asarray(spot, dtype=np.float64).reshape(1, 4, 2)
+        bounds, bounds_area = self._geometry(coords)
+        self.bounds[spot_idx] = bounds[0]
+        self.bounds_area[spot_idx] = bounds_area[0]
+        if self.mode == 'exact':
+            origin, size, table = self._rasterize(coords[0])
+            self.raster_origin[spot_idx] = origin
+            self.raster_size[spot_idx] = size
+            self._tables[spot_idx] = table
+            self._pack_rasters()
+        if self.index is not None:
+            self.index.update(spot_idx, self.bounds[spot_idx])
+
+    def remove_spot(self, spot_idx):
+        self.bounds = np.delete(self.bounds, spot_idx, axis=0)
+        self.bounds_area = np.delete(self.bounds_area, spot_idx)
+        self.spot_count -= 1
+        if self.mode == 'exact':
+            self.raster_origin = np.delete(self.raster_origin, spot_idx, axis=0)
+            self.raster_size = np.delete(self.raster_size, spot_idx, axis=0)
+            del self._tables[spot_idx]
+            self._pack_rasters()
+        if self.index is not None:
+            self.index.delete(spot_idx)
+        if self.spot_count < self.index_min_spots:
+            self.index = None
+
+    def _insert_spot(self, spot_idx, spot):
+        coords = np.asarray(spot, dtype=np.float64).reshape(1, 4, 2)
+        bounds, bounds_area = self._geometry(coords)
+        self.bounds = np.concatenate([self.bounds, bounds])
+        self.bounds_area = np.concatenate([self.bounds_area, bounds_area])
+        self.spot_count += 1
+        if self.mode == 'exact':
+            origin, size, table = self._rasterize(coords[0])
+            self.raster_origin = np.concatenate([self.raster_origin, origin.reshape(1, 2)])
+            self.raster_size = np.concatenate([self.raster_size, size.reshape(1, 2)])
+            self._tables.append(table)
+            self._pack_rasters()
+        if self.index is not None:
+            self.index.insert(spot_idx, self.bounds[spot_idx])
+        elif self.spot_count >= self.index_min_spots:
+            self._build_index()
+
+    @staticmethod
+    def _geometry(coords):
+        xs, ys = coords[:, :, 0], coords[:, :, 1]
+        bounds = np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+        bounds_area = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+        return bounds, bounds_area
+
+    def _rasterize(self, pts):
+        # Filled mask of one spot cropped to its bounds, stored as an integral image
+        scaled = pts * self.raster_scale
+        origin = np.floor(scaled.min(axis=0)).astype(np.int64)
+        size = np.ceil(scaled.max(axis=0)).astype(np.int64) - origin + 1
+        mask = np.zeros((size[1], size[0]), dtype=np.uint8)
+        cv2.fillPoly(mask, [np.rint(scaled - origin).astype(np.int32)], 1)
+        return origin, size, cv2.integral(mask).ravel()
+
+    def _pack_rasters(self):
+        # All integral images live in one flat array so lookups for every pair are one gather
+        lengths = np.array([len(table) for table in self._tables], dtype=np.int64)
+        self.raster_offset = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        if self._tables:
+            self.integral = np.concatenate(self._tables)
+            self.raster_area = self.integral[self.raster_offset + lengths - 1].astype(np.float64)
+        else:
+            self.integral = np.zeros(0, dtype=np.int32)
+            self.raster_area = np.zeros(0, dtype=np.float64)
+
+    def _build_index(self):
+        if self.spot_count < self.index_min_spots:
+            self.index = None
+            return
+        cell_size = self.index_cell_size
+        if cell_size is None:
+            # About one spot per cell keeps the candidate lists short
+            sizes = np.concatenate([self.bounds[:, 2] - self.bounds[:, 0], self.bounds[:, 3] - self.bounds[:, 1]])
+            cell_size = max(float(np.median(sizes)), 16.0)
+        self.index = SpotGridIndex(cell_size)
+        self.index.rebuild(self.bounds)
+
+    @staticmethod
+    def as_boxes(boxes):
+        # Accepts (x1, y1, x2, y2) boxes or raw detection rows, coordinates are
+        # truncated to pixels like the per-spot code used to do
+        boxes = np.asarray(boxes, dtype=np.float64)
+        if boxes.size == 0:
+            return np.empty((0, 4), dtype=np.float64)
+        return np.trunc(boxes.reshape(len(boxes), -1)[:, :4])
+
+    def candidate_pairs(self, boxes):
+        if self.index is not None:
+            return self.index.query_pairs(boxes)
+        car_idx = np.repeat(np.arange(len(boxes)), self.spot_count)
+        spot_idx = np.tile(np.arange(self.spot_count), len(boxes))
+        return car_idx, spot_idx
+
+    def covered_fraction(self, boxes, spot_idx):
+        # Fraction of each spot polygon covered by the paired box, boxes[k] is
+        # scored against spot_idx[k]
+        scaled = np.rint(self.as_boxes(boxes) * self.raster_scale).astype(np.int64)
+        width = self.raster_size[spot_idx, 0]
+        height = self.raster_size[spot_idx, 1]
+        x0 = np.clip(scaled[:, 0] - self.raster_origin[spot_idx, 0], 0, width)
+        x1 = np.clip(scaled[:, 2] - self.raster_origin[spot_idx, 0], 0, width)
+        y0 = np.clip(scaled[:, 1] - self.raster_origin[spot_idx, 1], 0, height)
+        y1 = np.clip(scaled[:, 3] - self.raster_origin[spot_idx, 1], 0, height)
+
+        base = self.raster_offset[spot_idx]
+        stride = width + 1
+        table = self.integral
+        covered = (table[base + y1 * stride + x1] - table[base + y0 * stride + x1] -
+                   table[base + y1 * stride + x0] + table[base + y0 * stride + x0])
+
+        area = self.raster_area[spot_idx]
+        fraction = np.zeros(len(spot_idx), dtype=np.float64)
+        np.divide(covered, area, out=fraction, where=area > 0)
+        return fraction
+
+    def pair_scores(self, boxes, car_idx, spot_idx):
+        pair_boxes = boxes[car_idx]
+        spot_bounds = self.bounds[spot_idx]
+        inter_w = np.minimum(pair_boxes[:, 2], spot_bounds[:, 2]) - np.maximum(pair_boxes[:, 0], spot_bounds[:, 0])
+        inter_h = np.minimum(pair_boxes[:, 3], spot_bounds[:, 3]) - np.maximum(pair_boxes[:, 1], spot_bounds[:, 1])
+        inter_area = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+        scores = np.zeros(len(car_idx), dtype=np.float64)
+
+        if self.mode == 'exact':
+            # Only pairs whose bounds touch can cover any of the polygon
+            touching = np.flatnonzero(inter_area > 0)
+            if len(touching):
+                scores[touching] = self.covered_fraction(pair_boxes[touching], spot_idx[touching])
+            return scores
+
+        box_area = (pair_boxes[:, 2] - pair_boxes[:, 0]) * (pair_boxes[:, 3] - pair_boxes[:, 1])
+        denom = np.minimum(box_area, self.bounds_area[spot_idx])
+        np.divide(inter_area, denom, out=scores, where=(inter_area > 0) & (denom > 0))
+        return scores
+
+    def overlap(self, boxes):
+        boxes = self.as_boxes(boxes)
+        ratio = np.zeros((len(boxes), self.spot_count), dtype=np.float64)
+        if len(boxes) and self.spot_count:
+            car_idx, spot_idx = self.candidate_pairs(boxes)
+            ratio[car_idx, spot_idx] = self.pair_scores(boxes, car_idx, spot_idx)
+        return ratio
+
+    def occupancy(self, boxes):
+        boxes = self.as_boxes(boxes)
+        occupied = np.zeros(self.spot_count, dtype=bool)
+        if len(boxes) == 0 or self.spot_count == 0:
+            return occupied
+        car_idx, spot_idx = self.candidate_pairs(boxes)
+        scores = self.pair_scores(boxes, car_idx, spot_idx)
+        occupied[spot_idx[scores > self.threshold]] = True
+        return occupied
+
+
+class SpotStateTracker:
+    # Per-spot state machine over the raw per-pass occupancy. Each spot keeps an
+    # EMA of its detections; an occupied spot is released once the EMA drops
+    # below off_threshold and a free spot is taken once it reaches on_threshold,
+    # and either change only sticks after holding for dwell_seconds.
+    def __init__(self, spot_count, alpha=0.4, on_threshold=0.6, off_threshold=0.3, dwell_seconds=2.0,
+                 settle_margin=0.05):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        if off_threshold > on_threshold:
+            raise ValueError("off_threshold must not be above on_threshold")
+        self.alpha = alpha
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.dwell_seconds = dwell_seconds
+        self.settle_margin = settle_margin
+        self.reset(spot_count)
+
+    def reset(self, spot_count):
+        self.confidence = np.zeros(spot_count, dtype=np.float64)
+        self.state = np.zeros(spot_count, dtype=bool)
+        self.pending_since = np.full(spot_count, np.nan)
+        self.initialized = np.zeros(spot_count, dtype=bool)
+
+    def add_spot(self):
+        self.confidence = np.append(self.confidence, 0.0)
+        self.state = np.append(self.state, False)
+        self.pending_since = np.append(self.pending_since, np.nan)
+        self.initialized = np.append(self.initialized, False)
+
+    def reset_spot(self, spot_idx):
+        self.confidence[spot_idx] = 0.0
+        self.state[spot_idx] = False
+        self.pending_since[spot_idx] = np.nan
+        self.initialized[spot_idx] = False
+
+    def remove_spot(self, spot_idx):
+        self.confidence = np.delete(self.confidence, spot_idx)
+        self.state = np.delete(self.state, spot_idx)
+        self.pending_since = np.delete(self.pending_since, spot_idx)
+        self.initialized = np.delete(self.initialized, spot_idx)
+
+    def is_settled(self):
+        # False while a change is pending or some EMA is still moving between
+        # free and occupied; callers must keep feeding observations until then
+        if not np.isnan(self.pending_since).all():
+            return False
+        margin = self.settle_margin
+        return bool(((self.confidence <= margin) | (self.confidence >= 1 - margin)).all())
+
+    def update(self, observed, now=None):
+        # Returns [(spot_idx, occupied), ...] for the spots that changed state
+        now = time.monotonic() if now is None else now
+        observed = np.asarray(observed, dtype=np.float64)
+        previous = self.state.copy()
+
+        # Spots seen for the first time take the observation as is, there is no
+        # history to smooth against yet
+        fresh = ~self.initialized
+        self.confidence[fresh] = observed[fresh]
+        self.state[fresh] = observed[fresh] >= 0.5
+        self.initialized[:] = True
+
+        settled = ~fresh
+        self.confidence[settled] += self.alpha * (observed[settled] - self.confidence[settled])
+        wanted = np.where(self.state, self.confidence >= self.off_threshold, self.confidence >= self.on_threshold)
+        differs = settled & (wanted != self.state)
+
+        self.pending_since[~differs] = np.nan
+        starting = differs & np.isnan(self.pending_since)
+        self.pending_since[starting] = now
+        flip = differs & (now - self.pending_since >= self.dwell_seconds)
+        self.state[flip] = wanted[flip]
+        self.pending_since[flip] = np.nan
+
+        changed = np.flatnonzero(self.state != previous)
+        return [(int(i), bool(self.state[i])) for i in changed]
+
+
+class SpotChangeDetector:
+    # Cheap gate in front of inference. The frame is downsampled to grayscale and
+    # compared with the one from the last inference, averaged inside each spot's
+    # mask. Inference is only needed when some spot changed by more than
+    # threshold grey levels, or when max_staleness seconds have passed.
+    def __init__(self, spots, scale=0.125, threshold=10.0, max_staleness=30.0):
+        self.scale = scale
+        self.threshold = threshold
+        self.max_staleness = max_staleness
+        self.reference = None
+        self.last_inference = None
+        self._current = None
+        self.set_spots(spots)
+
+    def set_spots(self, spots):
+        self.spots = [list(spot) for spot in spots]
+        self._labels = None
+        self._shape = None
+        self.reference = None
+
+    def _build_labels(self, shape):
+        # Label raster at the downsampled size, 0 is background and i + 1 is spot i
+        height, width = shape[:2]
+        small_size = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        labels = np.zeros((small_size[1], small_size[0]), dtype=np.int32)
+        for i, spot in enumerate(self.spots):
+            pts = np.rint(np.array(spot, dtype=np.float64).reshape(4, 2) * self.scale).astype(np.int32)
+            cv2.fillPoly(labels, [pts], i + 1)
+        self._labels = labels.ravel()
+        self._pixel_counts = np.maximum(np.bincount(self._labels, minlength=len(self.spots) + 1)[1:], 1)
+        self._small_size = small_size
+        self._shape = shape[:2]
+
+    def _downsample(self, frame):
+        if self._shape != frame.shape[:2]:
+            self._build_labels(frame.shape)
+            self.reference = None
+        small = cv2.resize(frame, self._small_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def spot_changes(self, frame):
+        # Mean absolute grey-level change per spot since the last inference
+        self._current = self._downsample(frame)
+        if self.reference is None:
+            return None
+        diff = cv2.absdiff(self._current, self.reference).ravel()
+        sums = np.bincount(self._labels, weights=diff, minlength=len(self.spots) + 1)[1:]
+        return sums / self._pixel_counts
+
+    def should_run(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        changes = self.spot_changes(frame)
+        if changes is None or self.last_inference is None:
+            return True
+        if now - self.last_inference >= self.max_staleness:
+            return True
+        return bool(len(changes)) and bool((changes > self.threshold).any())
+
+    def mark_inference(self, frame, now=None):
+        # Always from the inferred frame itself: inference can run without a
+        # should_run() call for it (e.g. while the state tracker settles)
+        self.reference = self._downsample(frame)
+        self.last_inference = time.monotonic() if now is None else now
@@ -0,0 +1,87 @@
+import datetime
+import json
+import threading
+
+
+class MongoHistorySink:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def write(self, events):
+        self.collection.insert_many(events, ordered=False)
+
+
+class JsonlHistorySink:
+    # Local append-only file, one JSON event per line
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events):
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(dict(event, timestamp=event['timestamp'].isoformat())) + '\n')
+
+
+class OccupancyHistoryRecorder:
+    # Records spot state changes (not per-frame snapshots) for one camera. Events
+    # are buffered in memory and written in bulk from a background thread once
+    # max_batch events are waiting or flush_interval seconds have passed, so
+    # recording never adds database latency to the detection path.
+    def __init__(self, sink, camera_id, max_batch=500, flush_interval=10.0, max_buffered=50000):
+        self.sink = sink
+        self.camera_id = camera_id
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._events = []
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='OccupancyHistory', daemon=True)
+        self._thread.start()
+
+    def record_changes(self, changes, timestamp=None):
+        # changes is [(spot_idx, occupied), ...] as produced by SpotStateTracker
+        if not changes:
+            return
+        timestamp = timestamp or datetime.datetime.now()
+        events = [
+            {"timestamp": timestamp, "meta": {"cameraId": self.camera_id, "spotId": spot_idx}, "occupied": occupied}
+            for spot_idx, occupied in changes
+        ]
+        with self._condition:
+            self._events.extend(events)
+            if len(self._events) > self.max_buffered:
+                dropped = len(self._events) - self.max_buffered
+                del self._events[:dropped]
+                print(f"Occupancy history buffer full, dropped {dropped} events")
+            if len(self._events) >= self.max_batch:
+                self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            events, self._events = self._events, []
+        if not events:
+            return
+        try:
+            self.sink.write(events)
+        except Exception as e:
+            print(f"Failed to write occupancy history: {e}")
+            # Keep the events for the next flush, older ones first
+            with self._condition:
+                self._events = events + self._events
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and len(self._events) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+                if not self._running:
+                    return
+            self.flush()
@@ -1,4 +1,5 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QHBoxLayout, QFormLayout
+from async_db import get_async_database
 
 class PaymentInformationScreen(QWidget):
     def __init__(self, stacked_widget, db, main_app):
@@ -6,6 +7,7 @@ class PaymentInformationScreen(QWidget):
         self.stacked_widget = stacked_widget
         self.initUI()
         self.db = db
+        self.async_db = get_async_database(db)
         self.current_user = None
         self.main_app = main_app
 
@@ -32,6 +34,8 @@ class PaymentInformationScreen(QWidget):
         layout.addWidget(QLabel('Top-Up Amount:'))
         layout.addWidget(self.top_up_amount_input)
         layout.addWidget(self.top_up_button)
+        self.top_up_status_label = QLabel('', self)
+        layout.addWidget(self.top_up_status_label)
 
 
         # Back to Settings Button
@@ -63,13 +67,26 @@ class PaymentInformationScreen(QWidget):
         dashboard_index = self.main_app.widget_indices.get('dashboard_screen')
         dashboard_screen = self.stacked_widget.widget(dashboard_index)
 
-        # Update the balance in the database
-        self.db.update_account_balance(self.current_user, top_up_amount)
-
-        # Clear the inputs and update the dashboard
+        # Update the balance in the database, the dashboard refreshes once it is stored
+        self.top_up_button.setEnabled(False)
+        self.top_up_status_label.setText('Processing top-up...')
+        self.async_db.update_account_balance(
+            self.current_user, top_up_amount,
+            on_result=lambda _: self.finish_top_up(dashboard_screen),
+            on_error=self.show_request_error
+        )
+
+    def finish_top_up(self, dashboard_screen):
+        self.top_up_button.setEnabled(True)
+        self.top_up_status_label.setText('Top-up successful')
+        dashboard_screen.update_balance()
+        # Only cleared once stored, a failed top-up keeps what was entered
         self.card_number_input.clear()
         self.top_up_amount_input.clear()
-        dashboard_screen.update_balance()
+
+    def show_request_error(self, error):
+        self.top_up_button.setEnabled(True)
+        self.top_up_status_label.setText(f'Top-up failed, could not reach the server: {error}')
 
     def set_current_user(self, username):
         self.current_user = username
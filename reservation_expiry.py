@@ -0,0 +1,101 @@
+import datetime
+import heapq
+import threading
+
+
+class ReservationExpiryService:
+    # Releases reservations at their expirationTime. Deadlines sit in a min-heap
+    # and a single background thread sleeps until the earliest one. The release
+    # itself is a conditional update in Database.expire_reservation, so a spot is
+    # freed exactly once even when several kiosks run this service.
+    def __init__(self, db, retry_seconds=5.0):
+        self.db = db
+        # A release that failed (e.g. the database was unreachable) is tried again after this
+        self.retry_seconds = retry_seconds
+        self._heap = []
+        self._scheduled = {}
+        self._listeners = []
+        self._running = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='ReservationExpiry', daemon=True)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def subscribe(self, callback):
+        # callback(spot_id, username) runs on the expiry thread
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def schedule(self, spot_id, expiration_time):
+        if expiration_time is None:
+            return
+        with self._condition:
+            if self._scheduled.get(spot_id) == expiration_time:
+                return
+            self._scheduled[spot_id] = expiration_time
+            heapq.heappush(self._heap, (expiration_time, spot_id))
+            self._condition.notify()
+
+    def cancel(self, spot_id):
+        # The heap entry stays behind and is skipped when it comes up
+        with self._condition:
+            self._scheduled.pop(spot_id, None)
+
+    def _next_due(self):
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                expiration_time, spot_id = self._heap[0]
+                if self._scheduled.get(spot_id) != expiration_time:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = (expiration_time - datetime.datetime.now()).total_seconds()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._scheduled[spot_id]
+                return spot_id
+            return None
+
+    def _retry(self, spot_id):
+        # Nothing else would schedule the spot again in change stream mode. A
+        # schedule() or cancel() that came in meanwhile takes precedence.
+        retry_at = datetime.datetime.now() + datetime.timedelta(seconds=self.retry_seconds)
+        with self._condition:
+            if spot_id in self._scheduled:
+                return
+            self._scheduled[spot_id] = retry_at
+            heapq.heappush(self._heap, (retry_at, spot_id))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            spot_id = self._next_due()
+            if spot_id is None:
+                return
+            try:
+                username = self.db.expire_reservation(spot_id)
+            except Exception as e:
+                print(f"Failed to expire reservation for spot {spot_id}, retrying in {self.retry_seconds}s: {e}")
+                self._retry(spot_id)
+                continue
+            if username is None:
+                continue
+            for callback in list(self._listeners):
+                try:
+                    callback(spot_id, username)
+                except Exception as e:
+                    print(f"Expiry listener failed: {e}")
@@ -1,15 +1,16 @@
+import sys
 import cv2
 import numpy as np
+from frame_source import open_frame_source, default_source
 
 class ParkingSpotDrawer:
     def __init__(self, video_path):
-        self.video = cv2.VideoCapture(video_path)
-        if not self.video.isOpened():
-            raise ValueError(f"Could not open video file: {video_path}")
-        
-        ret, self.frame = self.video.read()
+        self.video = open_frame_source(video_path)
+        ret, frame = self.video.read()
         if not ret:
             raise ValueError("Could not read first frame from video")
+        # Spots are drawn onto this frame, so it must not share the decoder's buffer
+        self.frame = frame.copy()
         
         self.points = []
         self.current_spot = []
@@ -61,7 +62,7 @@ class ParkingSpotDrawer:
         print(f"Saved {len(self.spots)} parking spots to {filename}")
 
 if __name__ == "__main__":
-    video_path = 'example.mp4'  # Replace with your video path
+    video_path = sys.argv[1] if len(sys.argv) > 1 else default_source('example.mp4')
     try:
         drawer = ParkingSpotDrawer(video_path)
         spots = drawer.run()
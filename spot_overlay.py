@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+
+FREE, OCCUPIED, RESERVED = 0, 1, 2
+SPOT_COLORS = {
+    FREE: (57, 255, 20),     # Green
+    OCCUPIED: (0, 0, 255),   # Red
+    RESERVED: (0, 255, 255)  # Yellow
+}
+LABEL_BACKGROUND = (50, 50, 50)
+
+
+class SpotOverlayRenderer:
+    # Spot outlines and labels for the camera view. Geometry and label layout are
+    # computed once per display size and every label is rendered ahead of time in
+    # each state colour, so a frame costs a polylines call and a slice copy per
+    # spot instead of a text layout, a filled rectangle and putText.
+    def __init__(self, spots, scale_x, scale_y=None, font_scale=1.0, thickness=3):
+        self.spots = spots
+        self.scale_x = scale_x
+        self.scale_y = scale_x if scale_y is None else scale_y
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self._layout()
+
+    def set_spots(self, spots):
+        self.spots = spots
+        self._layout()
+
+    def set_scale(self, scale_x, scale_y=None):
+        scale_y = scale_x if scale_y is None else scale_y
+        if (scale_x, scale_y) != (self.scale_x, self.scale_y):
+            self.scale_x, self.scale_y = scale_x, scale_y
+            self._layout()
+
+    def _layout(self):
+        coords = np.array(self.spots, dtype=np.float64).reshape(-1, 4, 2)
+        coords[:, :, 0] *= self.scale_x
+        coords[:, :, 1] *= self.scale_y
+        coords = coords.astype(np.int32)
+        self._polygons = [pts.reshape((-1, 1, 2)) for pts in coords]
+        self._labels = []
+        for i, pts in enumerate(coords):
+            text = f"Spot {i}"
+            text_size, _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, self.thickness)
+            center_x = int(pts[:, 0].sum() / 4)
+            center_y = int(pts[:, 1].sum() / 4)
+            text_x = center_x - text_size[0] // 2
+            text_y = center_y + text_size[1] // 2
+            # The label background box, inclusive on both ends like cv2.rectangle
+            padding = max(2, round(5 * self.font_scale))
+            left, top = text_x - padding, text_y - text_size[1] - padding
+            right, bottom = text_x + text_size[0] + padding, text_y + padding
+            patches = {}
+            for state, color in SPOT_COLORS.items():
+                patch = np.empty((bottom - top + 1, right - left + 1, 3), dtype=np.uint8)
+                patch[:] = LABEL_BACKGROUND
+                cv2.putText(patch, text, (text_x - left, text_y - top), cv2.FONT_HERSHEY_SIMPLEX,
+                            self.font_scale, color, self.thickness)
+                patches[state] = patch
+            self._labels.append((left, top, patches))
+
+    def spot_states(self, spot_status, reserved_spots):
+        states = np.array([OCCUPIED if spot_status.get(i, False) else FREE for i in range(len(self.spots))],
+                          dtype=np.uint8)
+        reserved = [spot for spot in reserved_spots if 0 <= spot < len(self.spots)]
+        states[reserved] = RESERVED
+        return states
+
+    def render(self, frame, spot_status, reserved_spots):
+        # Draws onto frame in place and returns the number of free spaces
+        states = self.spot_states(spot_status, reserved_spots).tolist()
+        height, width = frame.shape[:2]
+        # Outline then label, spot by spot, so overlapping spots stack the same way as before
+        for pts, (left, top, patches), state in zip(self._polygons, self._labels, states):
+            cv2.polylines(frame, [pts], True, SPOT_COLORS[state], 2)
+            patch = patches[state]
+            # Clip labels that hang off the edge of the frame
+            x0, y0 = max(left, 0), max(top, 0)
+            x1, y1 = min(left + patch.shape[1], width), min(top + patch.shape[0], height)
+            if x0 < x1 and y0 < y1:
+                frame[y0:y1, x0:x1] = patch[y0 - top:y1 - top, x0 - left:x1 - left]
+        return states.count(FREE)
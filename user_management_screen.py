@@ -1,10 +1,12 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QLineEdit, QMessageBox
+from async_db import get_async_database
 
 class UserManagementScreen(QWidget):
     def __init__(self, stacked_widget, db):
         super().__init__()
         self.stacked_widget = stacked_widget
         self.db = db
+        self.async_db = get_async_database(db)
         self.username = None
         self.initUI()
 
@@ -43,15 +45,23 @@ class UserManagementScreen(QWidget):
         new_password = self.password_input.text()
 
         if new_username and new_password:
-            success = self.db.change_username_password(self.db.get_user(self.current_user)['username'], new_username, new_password)
-
-            if success:
-                QMessageBox.information(self, 'Success', 'Username and Password changed successfully.')
-            else:
-                QMessageBox.warning(self, 'Error', 'Failed to change Username and Password.')
+            # Hashing the new password runs on the auth pool, not the GUI thread
+            self.change_button.setEnabled(False)
+            self.async_db.change_username_password(
+                self.current_user, new_username, new_password,
+                on_result=self.finishChange,
+                on_error=lambda error: self.finishChange(False)
+            )
         else:
             QMessageBox.warning(self, 'Error', 'Please enter both new Username and Password.')
 
+    def finishChange(self, success):
+        self.change_button.setEnabled(True)
+        if success:
+            QMessageBox.information(self, 'Success', 'Username and Password changed successfully.')
+        else:
+            QMessageBox.warning(self, 'Error', 'Failed to change Username and Password.')
+
     def gotoSettingsScreen(self):
         from settings_screen import SettingsScreen
 
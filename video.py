@@ -1,22 +1,31 @@
+import sys
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import imageio
+from model_registry import get_model
+from occupancy import SpotOccupancyEngine
+from frame_source import open_frame_source, default_source
 
 class ParkingDetector:
     def __init__(self, video_path, weights_path, spots_file='', display_scale=0.25, conf_threshold=0.7, iou_threshold=0.7):
-        # Load YOLOv8 model
-        self.model = YOLO(weights_path)
-        self.video = cv2.VideoCapture(video_path)
-        if not self.video.isOpened():
-            raise ValueError(f"Could not open video file: {video_path}")
+        # YOLOv8 model, loaded on first use and shared through model_registry
+        self.weights_path = weights_path
+        self._model = None
+        self.video = open_frame_source(video_path)
         
         self.spots = self.load_spots(spots_file)
+        self.occupancy_engine = SpotOccupancyEngine(self.spots)
         self.spot_status = {i: False for i in range(len(self.spots))}
         self.display_scale = display_scale
         self.conf_threshold = conf_threshold
         self.iou_threshold = iou_threshold
 
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_model(self.weights_path)
+        return self._model
+
     def load_spots(self, filename):
         spots = []
         try:
@@ -29,42 +38,14 @@ class ParkingDetector:
             print(f"Warning: {filename} not found. No parking spots loaded.")
         return spots
 
-    def intersect_area(self, box, spot):
-        spot_x = [spot[i] for i in range(0, 8, 2)]
-        spot_y = [spot[i] for i in range(1, 8, 2)]
-        spot_x1, spot_y1 = min(spot_x), min(spot_y)
-        spot_x2, spot_y2 = max(spot_x), max(spot_y)
-        
-        box_x1, box_y1, box_x2, box_y2 = box
-        
-        inter_x1 = max(box_x1, spot_x1)
-        inter_y1 = max(box_y1, spot_y1)
-        inter_x2 = min(box_x2, spot_x2)
-        inter_y2 = min(box_y2, spot_y2)
-        
-        if inter_x1 < inter_x2 and inter_y1 < inter_y2:
-            inter_area = (inter_x2 - inter_x1) * (inter_y2 - inter_y1)
-            box_area = (box_x2 - box_x1) * (box_y2 - box_y1)
-            spot_area = (spot_x2 - spot_x1) * (spot_y2 - spot_y1)
-            return inter_area / min(box_area, spot_area)
-        return 0.0
-
     def check_spot_occupation(self, box):
-        x1, y1, x2, y2 = box
-        occupied_spots = []
-        
-        for i, spot in enumerate(self.spots):
-            overlap = self.intersect_area(box, spot)
-            if overlap > 0.5:
-                occupied_spots.append(i)
-        
+        overlap = self.occupancy_engine.overlap([box])[0]
+        occupied_spots = np.flatnonzero(overlap > self.occupancy_engine.threshold).tolist()
         return occupied_spots if occupied_spots else [-1]
 
     def process_and_save_gif(self, output_path, duration=5):
-        # Get video properties
-        frame_width = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH) * self.display_scale)
-        frame_height = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT) * self.display_scale)
-        fps = int(self.video.get(cv2.CAP_PROP_FPS))
+        # Sources without a frame rate (e.g. image directories) are treated as 30 FPS
+        fps = int(self.video.fps or 30)
         
         # Use a reduced frame rate for GIF (e.g., 15 FPS)
         gif_fps = 15
@@ -75,7 +56,7 @@ class ParkingDetector:
         
         print(f"Processing first {duration} seconds of video at {gif_fps} FPS and saving as GIF to {output_path}...")
         
-        while self.video.isOpened() and frame_count < max_frames:
+        while self.video.is_opened() and frame_count < max_frames:
             ret, frame = self.video.read()
             if not ret:
                 print("End of video or error reading frame")
@@ -86,24 +67,21 @@ class ParkingDetector:
                 continue
                 
             # Resize frame for processing
+            frame_width = int(frame.shape[1] * self.display_scale)
+            frame_height = int(frame.shape[0] * self.display_scale)
             display_frame = cv2.resize(frame, (frame_width, frame_height), interpolation=cv2.INTER_AREA)
             
             # YOLOv8 detection
             results = self.model(frame, conf=self.conf_threshold, iou=self.iou_threshold)
             car_detections = [box for box in results[0].boxes if int(box.cls) == 2]  # Class 2 is 'car' in COCO
             
-            # Reset spot status
-            self.spot_status = {i: False for i in range(len(self.spots))}
+            # Score all cars against all spots at once
+            boxes = np.array([detection.xyxy[0].tolist() for detection in car_detections]).reshape(-1, 4)
+            self.spot_status = dict(enumerate(self.occupancy_engine.occupancy(boxes).tolist()))
             
             # Draw car detections
             for detection in car_detections:
                 x1, y1, x2, y2 = map(int, detection.xyxy[0])
-                box = (x1, y1, x2, y2)
-                spot_indices = self.check_spot_occupation(box)
-                
-                for spot_idx in spot_indices:
-                    if spot_idx >= 0:
-                        self.spot_status[spot_idx] = True
                 
                 # Scale coordinates for display
                 x1_display = int(x1 * self.display_scale)
@@ -141,7 +119,7 @@ class ParkingDetector:
 
 if __name__ == "__main__":
     # Input and output paths
-    video_path = 'example.mp4'
+    video_path = sys.argv[1] if len(sys.argv) > 1 else default_source('example.mp4')
     weights_path = 'yolov8m.pt'
     output_path = 'output_detections.gif'
     
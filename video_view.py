@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter
+
+# Qt 5.14+ reads OpenCV's BGR layout directly, older versions need one conversion
+HAS_BGR888 = hasattr(QImage, 'Format_BGR888')
+
+
+class VideoView(QtWidgets.QWidget):
+    # Paints BGR frames straight from a preallocated numpy buffer. Callers draw
+    # into frame_buffer() and hand it to show_frame(); the QImage wrapping the
+    # buffer is built once per size, so no pixmap or RGB copy is made per frame.
+    resized = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self._buffer = None
+        self._rgb_buffer = None
+        self._image = None
+
+    def frame_buffer(self, width, height):
+        if self._buffer is None or self._buffer.shape[:2] != (height, width):
+            self._buffer = np.zeros((height, width, 3), dtype=np.uint8)
+            if HAS_BGR888:
+                self._image = QImage(self._buffer.data, width, height, self._buffer.strides[0], QImage.Format_BGR888)
+            else:
+                self._rgb_buffer = np.zeros_like(self._buffer)
+                self._image = QImage(self._rgb_buffer.data, width, height, self._rgb_buffer.strides[0],
+                                     QImage.Format_RGB888)
+        return self._buffer
+
+    def show_frame(self, frame):
+        height, width = frame.shape[:2]
+        buffer = self.frame_buffer(width, height)
+        if frame is not buffer:
+            np.copyto(buffer, frame)
+        if not HAS_BGR888:
+            cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=self._rgb_buffer)
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit(self.width(), self.height())
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self._image is None:
+            painter.fillRect(self.rect(), Qt.black)
+        else:
+            if self._image.size() != self.size():
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawImage(self.rect(), self._image)
+        painter.end()